@@ -0,0 +1,221 @@
+"""
+Batch evaluation of many query files against one Twitterverse.
+
+Queries are grouped by starting username so that every distinct
+(username, operations prefix) frontier is expanded only once, however many
+queries share it.  The filter and present stages of each query then run in a
+pool of worker processes, each of which maps a snapshot of the dataset, so
+the workers share its pages; a data file is parsed once and written to a
+temporary snapshot for them.  The outputs are exactly those of
+run_query on each query in turn; a query that run_query would reject gets
+the error it would raise in place of an output, and the others still run.
+"""
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from twitterverse_functions import (get_filter_results, get_present_string,
+                                    process_data, process_query,
+                                    search_operations)
+from twitterverse_compact import load_compact
+from twitterverse_graph import build_graph
+from twitterverse_snapshot import MAGIC, load_snapshot, write_snapshot
+
+# The errors a malformed or invalid query raises
+QUERY_ERRORS = (ValueError, IndexError, KeyError)
+
+
+def is_snapshot(path):
+    """ (str) -> bool
+
+    Return True iff the file at path is a snapshot written by
+    twitterverse_snapshot.write_snapshot.
+    """
+    with open(path, 'rb') as data_file:
+        return data_file.read(len(MAGIC)) == MAGIC
+
+
+def load_dataset(path, compact=False):
+    """ (str[, bool]) -> Twitterverse dictionary
+
+    Return the Twitterverse stored at path, either a snapshot written by
+    twitterverse_snapshot.write_snapshot or a data file for process_data.
+    If compact, a data file is loaded by twitterverse_compact.load_compact
+    instead, to save memory.
+    """
+    if is_snapshot(path):
+        return load_snapshot(path)
+    if compact:
+        return load_compact(path)
+    with open(path) as data_file:
+        return process_data(data_file)
+
+
+def dataset_graph(twitterverse):
+    """ (Twitterverse dictionary) -> TwitterGraph
+
+    Return a TwitterGraph for twitterverse, reusing a snapshot's arrays.
+    """
+    if hasattr(twitterverse, 'graph'):
+        return twitterverse.graph()
+    return build_graph(twitterverse)
+
+
+def query_paths(queries):
+    """ (str or list of str) -> list of str
+
+    Return the query files named by queries: either a directory, whose files
+    are returned in sorted order, or a list of file paths.
+    """
+    if isinstance(queries, str):
+        return sorted(os.path.join(queries, name)
+                      for name in os.listdir(queries)
+                      if os.path.isfile(os.path.join(queries, name)))
+    return list(queries)
+
+
+def search_frontier(graph, username, operations, frontiers):
+    """ (TwitterGraph, str, tuple of str, dict) -> list of int
+
+    Return the IDs get_search_results would report for username and
+    operations, reusing and extending frontiers, the frontiers already
+    expanded for username keyed by operations prefix.
+    """
+    if operations in frontiers:
+        return frontiers[operations]
+    if not operations:
+        uid = graph.user_id(username)
+        frontier = [] if uid < 0 else [uid]
+    else:
+        if operations[0] == 'following' and username not in graph:
+            raise KeyError(username)
+        frontier = search_frontier(graph, username, operations[:-1], frontiers)
+        if frontier:
+            frontier = graph.expand(frontier, operations[-1])
+    frontiers[operations] = frontier
+    return frontier
+
+
+def shared_search_results(graph, queries):
+    """ (TwitterGraph, list of Query dictionary) -> list of (list of str or
+    Exception)
+
+    Return the search results of each query in queries, expanding each
+    distinct (username, operations prefix) frontier once, or the error the
+    search of a query raises.
+    """
+    by_username = {}
+    for i, query in enumerate(queries):
+        by_username.setdefault(query['search']['username'], []).append(i)
+    results = [None] * len(queries)
+    names = graph.names
+    for username, group in by_username.items():
+        frontiers = {}
+        for i in group:
+            try:
+                operations = tuple(search_operations(queries[i]['search']))
+                frontier = search_frontier(graph, username, operations,
+                                           frontiers)
+            except QUERY_ERRORS as error:
+                results[i] = error
+            else:
+                results[i] = [names[uid] for uid in frontier]
+    return results
+
+
+_worker = {}
+
+
+def _init_worker(snapshot_path):
+    """ (str) -> NoneType
+
+    Load the snapshot at snapshot_path into this worker process.
+    """
+    _worker['twitterverse'] = load_dataset(snapshot_path)
+    _worker['graph'] = dataset_graph(_worker['twitterverse'])
+
+
+def _filter_and_present(task):
+    """ (tuple of (list of str, dict, dict)) -> str or Exception
+
+    Return the presentation of the search results in task after filtering,
+    using this worker's dataset, or the error filtering or presenting them
+    raises.
+    """
+    results, filterd, present = task
+    twitterverse = _worker['twitterverse']
+    graph = _worker['graph']
+    try:
+        results = get_filter_results(twitterverse, results, filterd, graph)
+        return get_present_string(twitterverse, results, present, graph)
+    except QUERY_ERRORS as error:
+        return error
+
+
+def run_batch(data_path, queries, processes=None):
+    """ (str, str or list of str[, int]) -> dict of {str: str or Exception}
+
+    Return the output of each query file in queries (a directory or a list
+    of paths) run against the dataset at data_path, keyed by query path in
+    input order.  The output of a query file that cannot be read as a query,
+    or that run_query would reject, is the error raised instead.  The filter
+    and present stages run in processes worker processes (one per CPU by
+    default; 1 runs everything in this process).
+
+    >>> import os, tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> with open(os.path.join(folder, 'data.txt'), 'w') as data_file:
+    ...     _ = data_file.write('a\\nAnn\\n\\n\\nENDBIO\\nb\\nEND\\n'
+    ...                         'b\\nBob\\n\\n\\nENDBIO\\na\\nEND\\n')
+    >>> os.mkdir(os.path.join(folder, 'queries'))
+    >>> for name, start, operations in (('q1', 'a', 'following'),
+    ...                                 ('q2', 'a', 'following\\nfollowers'),
+    ...                                 ('q3', 'ghost', 'following')):
+    ...     with open(os.path.join(folder, 'queries', name), 'w') as query:
+    ...         _ = query.write('SEARCH\\n' + start + '\\n' + operations +
+    ...                         '\\nFILTER\\nPRESENT\\nsort-by username\\nformat short\\n')
+    >>> outputs = run_batch(os.path.join(folder, 'data.txt'),
+    ...                     os.path.join(folder, 'queries'), processes=1)
+    >>> [outputs[path] for path in sorted(outputs)]
+    ["['b']", "['a']", KeyError('ghost')]
+    """
+    paths = query_paths(queries)
+    outputs = {}
+    parsed = []
+    for path in paths:
+        with open(path) as query_file:
+            try:
+                parsed.append((path, process_query(query_file)))
+            except QUERY_ERRORS as error:
+                outputs[path] = error
+    twitterverse = load_dataset(data_path)
+    graph = dataset_graph(twitterverse)
+    results = shared_search_results(graph, [query for path, query in parsed])
+    searched = []
+    tasks = []
+    for (path, query), result in zip(parsed, results):
+        if isinstance(result, Exception):
+            outputs[path] = result
+        else:
+            searched.append(path)
+            tasks.append((result, query['filter'], query['present']))
+    if processes == 1:
+        _worker['twitterverse'] = twitterverse
+        _worker['graph'] = graph
+        try:
+            presented = [_filter_and_present(task) for task in tasks]
+        finally:
+            _worker.clear()
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            snapshot_path = data_path
+            if not is_snapshot(data_path):
+                snapshot_path = os.path.join(folder, 'dataset.snapshot')
+                write_snapshot(twitterverse, snapshot_path, graph)
+            with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                     initargs=(snapshot_path,)) as pool:
+                presented = list(pool.map(_filter_and_present, tasks,
+                                          chunksize=max(1, len(tasks) // 64)))
+    outputs.update(zip(searched, presented))
+    return {path: outputs[path] for path in paths}
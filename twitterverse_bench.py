@@ -0,0 +1,258 @@
+"""
+Synthetic Twitterverse data and a benchmark harness for the query pipeline.
+
+write_data_file generates a data file in the process_data format whose
+follower counts follow a power law: each user follows a heavy-tailed number
+of accounts, chosen with probability proportional to rank ** -skew, and has
+a name, location, website and multi-line bio of realistic lengths.
+write_query_files generates matching SEARCH/FILTER/PRESENT query files.
+
+run_benchmarks times each stage of the pipeline at several scales and writes
+one JSON object per measurement, so results can be compared across versions:
+
+    python twitterverse_bench.py --users 1000 10000 --output bench.jsonl
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from twitterverse_functions import (get_filter_results, get_present_string,
+                                    get_search_results, more_popular,
+                                    process_data, process_query, tweet_sort)
+from twitterverse_fulltext import BioIndex
+from twitterverse_graph import build_graph
+from twitterverse_influence import pagerank
+
+SYLLABLES = ('an', 'bel', 'cor', 'da', 'el', 'fin', 'gar', 'ho', 'is', 'jo',
+             'ka', 'lee', 'mar', 'no', 'or', 'pa', 'ri', 'sa', 'to', 'vin')
+CITIES = ('Toronto, Ontario', 'Los Angeles, CA', 'New York', 'London',
+          'Washington DC', 'Hollywood, California', 'Oz', 'Vancouver, BC',
+          'Houston, Texas', 'Mumbai, India', 'Sydney', 'Berlin')
+WORDS = ('the', 'and', 'music', 'love', 'official', 'tweets', 'news',
+         'politics', 'tech', 'founder', 'writer', 'fan', 'world', 'life',
+         'of', 'in', 'my', 'team', 'visit', 'us', 'at', 'best', 'daily')
+
+
+def _word(rng, syllables):
+    """ (Random, int) -> str
+
+    Return a made-up word of the given number of syllables.
+    """
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def generate_profiles(users, seed=0, skew=1.0, mean_following=20):
+    """ (int[, int, float, float]) -> generator of list
+
+    Yield users records [username, name, location, web, bio lines,
+    following] of a synthetic Twitterverse, deterministically for seed.
+    """
+    rng = random.Random(seed)
+    usernames = ['{0}{1}'.format(_word(rng, 2), i) for i in range(users)]
+    weights = [(rank + 1) ** -skew for rank in range(users)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    popular = usernames[:]
+    rng.shuffle(popular)
+    alpha = 1.5
+    scale = mean_following * (alpha - 1) / alpha
+    for username in usernames:
+        name = '{0} {1}'.format(_word(rng, rng.randint(1, 3)).title(),
+                                _word(rng, rng.randint(1, 4)).title())
+        location = rng.choice(CITIES) if rng.random() < 0.8 else ''
+        web = ('http://www.{0}.com'.format(username)
+               if rng.random() < 0.5 else '')
+        bio = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+               for _ in range(rng.choice((0, 1, 1, 2, 3)))]
+        count = min(users, int(scale * rng.paretovariate(alpha)))
+        following = rng.choices(popular, cum_weights=cumulative, k=count)
+        following = list(dict.fromkeys(f for f in following if f != username))
+        yield [username, name, location, web, bio, following]
+
+
+def write_data_file(data_file, users, seed=0, skew=1.0, mean_following=20):
+    """ (file open for writing, int[, int, float, float]) -> NoneType
+
+    Write a synthetic Twitterverse of users users to data_file in the format
+    read by process_data.
+
+    >>> data = io.StringIO()
+    >>> write_data_file(data, 50, seed=1)
+    >>> twitterverse = process_data(io.StringIO(data.getvalue()))
+    >>> len(twitterverse)
+    50
+    """
+    for username, name, location, web, bio, following in generate_profiles(
+            users, seed, skew, mean_following):
+        lines = [username, name, location, web] + bio + ['ENDBIO']
+        lines += following + ['END']
+        data_file.write('\n'.join(lines) + '\n')
+
+
+def generate_query(usernames, rng):
+    """ (list of str, Random) -> str
+
+    Return the text of a random query file over usernames.
+    """
+    operations = [rng.choice(('followers', 'following'))
+                  for _ in range(rng.choice((1, 1, 2, 2, 3)))]
+    filters = []
+    if rng.random() < 0.3:
+        filters.append('name-includes ' + rng.choice(SYLLABLES))
+    if rng.random() < 0.3:
+        filters.append('location-includes ' + rng.choice(CITIES).split(',')[0])
+    if rng.random() < 0.2:
+        filters.append('following ' + rng.choice(usernames))
+    if rng.random() < 0.2:
+        filters.append('follower ' + rng.choice(usernames))
+    present = ['sort-by ' + rng.choice(('popularity', 'username', 'name')),
+               'format ' + rng.choice(('short', 'long'))]
+    lines = (['SEARCH', rng.choice(usernames)] + operations + ['FILTER']
+             + filters + ['PRESENT'] + present)
+    return '\n'.join(lines) + '\n'
+
+
+def write_query_files(directory, usernames, count, seed=0):
+    """ (str, list of str, int[, int]) -> list of str
+
+    Write count random query files over usernames into directory and return
+    their paths.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'query{0:05d}.txt'.format(i))
+        with open(path, 'w') as query_file:
+            query_file.write(generate_query(usernames, rng))
+        paths.append(path)
+    return paths
+
+
+def _best_time(function, repeat):
+    """ (function, int) -> float
+
+    Return the least wall time in seconds of repeat calls to function.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_scale(users, queries=20, repeat=3, seed=0):
+    """ (int[, int, int, int]) -> list of dict of {str: object}
+
+    Return one measurement per pipeline stage for a synthetic Twitterverse
+    of users users and queries random queries.  Stage times are totals over
+    all the queries.
+    """
+    data = io.StringIO()
+    write_data_file(data, users, seed)
+    text = data.getvalue()
+    twitterverse = process_data(io.StringIO(text))
+    graph = build_graph(twitterverse)
+    usernames = list(twitterverse)
+    rng = random.Random(seed)
+    parsed = [process_query(io.StringIO(generate_query(usernames, rng)))
+              for _ in range(queries)]
+    searched = [get_search_results(twitterverse, query['search'], graph)
+                for query in parsed]
+    filtered = [get_filter_results(twitterverse, searched[i], query['filter'],
+                                   graph)
+                for i, query in enumerate(parsed)]
+
+    stages = {
+        'parse': lambda: process_data(io.StringIO(text)),
+        'build_graph': lambda: build_graph(twitterverse),
+        'influence': lambda: pagerank(graph),
+        'bio_index': lambda: BioIndex(twitterverse),
+        'get_search_results': lambda: [
+            get_search_results(twitterverse, query['search'], graph)
+            for query in parsed],
+        'get_filter_results': lambda: [
+            get_filter_results(twitterverse, searched[i], query['filter'],
+                               graph)
+            for i, query in enumerate(parsed)],
+        'tweet_sort': lambda: [
+            tweet_sort(twitterverse, results[:], more_popular)
+            for results in filtered],
+        'get_present_string': lambda: [
+            get_present_string(twitterverse, filtered[i], query['present'],
+                               graph)
+            for i, query in enumerate(parsed)],
+    }
+    environment = {'python': platform.python_version(),
+                   'platform': platform.platform()}
+    measurements = []
+    for stage, function in stages.items():
+        measurement = {'benchmark': stage, 'users': users,
+                       'edges': len(graph.fwd_targets), 'queries': queries,
+                       'repeat': repeat,
+                       'seconds': _best_time(function, repeat)}
+        measurement.update(environment)
+        measurements.append(measurement)
+    return measurements
+
+
+def run_benchmarks(scales, output, queries=20, repeat=3, seed=0):
+    """ (list of int, file open for writing[, int, int, int]) -> NoneType
+
+    Benchmark every pipeline stage at each number of users in scales and
+    write each measurement to output as a line of JSON.
+
+    >>> output = io.StringIO()
+    >>> run_benchmarks([30], output, queries=2, repeat=1)
+    >>> sorted(json.loads(line)['benchmark'] for line in output.getvalue().splitlines())[:3]
+    ['bio_index', 'build_graph', 'get_filter_results']
+    """
+    for users in scales:
+        for measurement in benchmark_scale(users, queries, repeat, seed):
+            output.write(json.dumps(measurement, sort_keys=True) + '\n')
+            output.flush()
+
+
+def main(argv=None):
+    """ ([list of str]) -> NoneType
+
+    Run the benchmarks named by the command line arguments argv.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000],
+                        help='numbers of users to benchmark')
+    parser.add_argument('--queries', type=int, default=20,
+                        help='random queries per scale')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per stage; the best time is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON lines file (default stdout)')
+    parser.add_argument('--data-file', metavar='PATH',
+                        help='only write a synthetic data file of the first '
+                             'scale to PATH')
+    args = parser.parse_args(argv)
+    if args.data_file:
+        with open(args.data_file, 'w') as data_file:
+            write_data_file(data_file, args.users[0], args.seed)
+        return
+    if args.output:
+        with open(args.output, 'a') as output:
+            run_benchmarks(args.users, output, args.queries, args.repeat,
+                           args.seed)
+    else:
+        run_benchmarks(args.users, sys.stdout, args.queries, args.repeat,
+                       args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Memoization of query results across the search, filter and present stages.
+
+A QueryCache keeps the search results, filtered results and presentation
+strings of recent queries under separate keys, so re-running a query with
+only its PRESENT block changed reuses the filtered results, and adding a
+FILTER line reuses the search results.  Every key includes a dataset version
+supplied by the caller; bump it whenever the Twitterverse changes and the
+stale entries simply age out.  Entries are evicted least recently used first
+once their estimated size exceeds the cache's byte budget.  Result lists are
+cached as tuples, so no caller can change what another is returned.
+"""
+
+import sys
+from collections import OrderedDict
+
+from twitterverse_functions import (COUNT_FORMATS, count_results,
+                                    get_filter_results, get_present_string,
+                                    get_search_results)
+
+STAGES = ('search', 'filter', 'present')
+
+
+def normalize_query(query):
+    """ (Query dictionary) -> tuple of (tuple, tuple, tuple)
+
+    Return hashable search, filter and presentation keys for query.  Filter
+    and presentation items are sorted, so their line order does not matter.
+
+    >>> normalize_query({'search': {'username': 'a', 'operations': ['followers']},\
+    'filter': {'name-includes': 'x', 'follower': 'b'},\
+    'present': {'sort-by': 'name', 'format': 'long'}})
+    (('a', ('followers',)), (('follower', 'b'), ('name-includes', 'x')), (('format', 'long'), ('sort-by', 'name')))
+    """
+    search = (query['search']['username'],
+              tuple(query['search']['operations']))
+    return (search, tuple(sorted(query['filter'].items())),
+            tuple(sorted(query['present'].items())))
+
+
+def _size(value):
+    """ (tuple of str or str) -> int
+
+    Return an estimate of the bytes held by value.
+    """
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(sys.getsizeof(x) for x in value)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """ A memory-bounded LRU cache of per-stage query results. """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """ (QueryCache[, int]) -> NoneType
+
+        Initialize an empty cache holding at most about max_bytes of results.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = dict.fromkeys(STAGES, 0)
+        self.misses = dict.fromkeys(STAGES, 0)
+        self.evictions = 0
+
+    def _get(self, key):
+        """ (QueryCache, tuple) -> object
+
+        Return the value cached under key, or None, counting a hit or miss
+        for the stage key[0].
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses[key[0]] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits[key[0]] += 1
+        return entry[0]
+
+    def _put(self, key, value):
+        """ (QueryCache, tuple, object) -> NoneType
+
+        Cache value under key, evicting least recently used entries to stay
+        within max_bytes.  Values larger than the whole budget are not kept.
+        """
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def run(self, twitterverse, query, version=0, graph=None, index=None):
+        """ (QueryCache, Twitterverse dictionary, Query dictionary[, object,
+        TwitterGraph, Text index dictionary]) -> str
+
+        Return run_query(twitterverse, query, graph, index), reusing any
+        stage already cached for the same query prefix and dataset version.
+        With graph, count formats are answered by count_results, as
+        run_query answers them, and cached whole.
+
+        >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+        'following': [], 'location': '', 'bio': ''},\
+        'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+        'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+        >>> query = {'search': {'username': 'katieH', 'operations': ['followers']},\
+        'filter': {}, 'present': {'sort-by': 'username', 'format': 'short'}}
+        >>> cache = QueryCache()
+        >>> cache.run(a, query)
+        "['tomCruise']"
+        >>> query['present']['format'] = 'long'
+        >>> cache.run(a, query).splitlines()[1]
+        'tomCruise'
+        >>> cache.stats()['hits']
+        {'search': 0, 'filter': 1, 'present': 0}
+        >>> query['search']['operations'] = ['following']
+        >>> query['present']['format'] = 'short'
+        >>> cache.run(a, query).append('x'); cache.run(a, query)
+        []
+        """
+        search, filterd, present = normalize_query(query)
+        present_key = ('present', version, search, filterd, present)
+        output = self._get(present_key)
+        if output is not None:
+            return list(output) if isinstance(output, tuple) else output
+        if graph is not None and query['present']['format'] in COUNT_FORMATS:
+            output = count_results(twitterverse, query, graph, index)
+            self._put(present_key, output)
+            return output
+        filter_key = ('filter', version, search, filterd)
+        results = self._get(filter_key)
+        if results is None:
+            search_key = ('search', version, search)
+            results = self._get(search_key)
+            if results is None:
+                results = tuple(get_search_results(
+                    twitterverse, query['search'], graph))
+                self._put(search_key, results)
+            results = tuple(get_filter_results(
+                twitterverse, list(results), query['filter'], graph, index))
+            self._put(filter_key, results)
+        output = get_present_string(twitterverse, list(results),
+                                    query['present'], graph)
+        if isinstance(output, list):
+            self._put(present_key, tuple(output))
+        else:
+            self._put(present_key, output)
+        return output
+
+    def stats(self):
+        """ (QueryCache) -> dict of {str: object}
+
+        Return the hit and miss counts per stage, the number of evictions,
+        entries and estimated bytes currently cached.
+        """
+        return {'hits': dict(self.hits), 'misses': dict(self.misses),
+                'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.bytes}
+
+    def clear(self):
+        """ (QueryCache) -> NoneType
+
+        Remove every entry, keeping the statistics.
+        """
+        self.entries.clear()
+        self.bytes = 0
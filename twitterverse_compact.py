@@ -0,0 +1,308 @@
+"""
+Compact in-memory storage of a Twitterverse data file.
+
+load_compact reads a data file into a CompactTwitterverse, a read-only
+Twitterverse dictionary that takes a fraction of the memory of the dict of
+dicts built by process_data:
+    - usernames are interned once, as integer user IDs shared with the
+      TwitterGraph returned by graph()
+    - following lists are the CSR arrays of that graph, 4 bytes per entry
+    - names and locations are kept in columns indexed by user ID, with
+      repeated locations stored once
+    - web and bio stay in the data file; only their byte offsets and lengths
+      are kept, and they are read back when a profile field is looked up,
+      which in the query pipeline happens only for the long format
+
+The data file must not change while the CompactTwitterverse is in use.
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping
+
+from twitterverse_functions import DataFormatError
+from twitterverse_graph import csr_graph
+
+ENCODING = 'utf-8'
+FIELDS = ('name', 'location', 'web', 'bio', 'following')
+
+
+def _truncated(line_no, username, start, expected):
+    """ (int, str, int, str) -> DataFormatError
+
+    Return the error iter_profiles raises for a truncated record.
+    """
+    return DataFormatError('line {0}: record {1!r} starting at line {2} is '
+                           'truncated (expected {3})'
+                           .format(line_no, username, start, expected))
+
+
+def _scan_records(data_file):
+    """ (binary file open for reading) -> generator of list
+
+    Yield [username, name, location, web span, bio span, following] for
+    each user in data_file, where a span is the (offset, length) of the
+    field's bytes in the file.  Records are checked as by iter_profiles.
+    """
+    lines = enumerate(data_file, 1)
+    for start, raw in lines:
+        line_no = start
+        info = []
+        while True:
+            line = raw.decode(ENCODING).rstrip()
+            if line == 'ENDBIO' or line == 'END':
+                raise DataFormatError('line {0}: unexpected {1} in the header '
+                                      'of the record starting at line {2}'
+                                      .format(line_no, line, start))
+            if len(info) == 3:
+                break
+            info.append(line)
+            line_no, raw = next(lines, (line_no, None))
+            if raw is None:
+                raise _truncated(line_no, info[0], start, 'ENDBIO')
+        bio_start = data_file.tell()
+        info.append((bio_start - len(raw), len(raw) if line else 0))
+        for line_no, raw in lines:
+            if (raw.startswith(b'ENDBIO')
+                    and raw.decode(ENCODING).rstrip() == 'ENDBIO'):
+                break
+        else:
+            raise _truncated(line_no, info[0], start, 'ENDBIO')
+        info.append((bio_start, data_file.tell() - len(raw) - bio_start))
+        following = []
+        for line_no, raw in lines:
+            line = raw.decode(ENCODING).rstrip()
+            if line == 'END':
+                break
+            following.append(line)
+        else:
+            raise _truncated(line_no, info[0], start, 'END')
+        info.append(following)
+        yield info
+
+
+class _Interner(dict):
+    """ A dictionary that gives each new key the next integer ID. """
+
+    def __missing__(self, key):
+        """ (_Interner, str) -> int """
+        uid = self[key] = len(self)
+        return uid
+
+
+class CompactProfile(Mapping):
+    """ A read-only profile dictionary of a CompactTwitterverse. """
+
+    __slots__ = ('_store', '_uid')
+
+    def __init__(self, store, uid):
+        """ (CompactProfile, CompactTwitterverse, int) -> NoneType """
+        self._store = store
+        self._uid = uid
+
+    def __getitem__(self, field):
+        """ (CompactProfile, str) -> object
+
+        Return the value of field, reading web and bio from the data file.
+        """
+        store = self._store
+        uid = self._uid
+        if field == 'name':
+            return store._name_column[uid]
+        if field == 'location':
+            return store._location_column[uid]
+        if field == 'web':
+            return store._read(store._web_starts[uid],
+                               store._web_lengths[uid]).rstrip()
+        if field == 'bio':
+            text = store._read(store._bio_starts[uid], store._bio_lengths[uid])
+            if not text:
+                return ''
+            return ' \n'.join(line.rstrip()
+                              for line in text.split('\n')[:-1]) + ' '
+        if field == 'following':
+            names = store.usernames
+            offsets = store._fwd_offsets
+            return [names[i] for i in
+                    store._fwd_targets[offsets[uid]:offsets[uid + 1]]]
+        raise KeyError(field)
+
+    def __iter__(self):
+        """ (CompactProfile) -> iterator of str """
+        return iter(FIELDS)
+
+    def __len__(self):
+        """ (CompactProfile) -> int """
+        return len(FIELDS)
+
+
+class CompactTwitterverse(Mapping):
+    """ A read-only Twitterverse dictionary stored in columns. """
+
+    def __init__(self, data_file, usernames, ids, known, columns,
+                 fwd_offsets, fwd_targets):
+        """ (CompactTwitterverse, binary file open for reading, list of str,
+        dict of {str: int}, int, dict of {str: list or array}, array, array)
+        -> NoneType
+
+        Initialize a Twitterverse over the first known users of usernames,
+        with ids mapping each username to its user ID.  columns maps 'name'
+        and 'location' to lists, and 'web_starts', 'web_lengths',
+        'bio_starts' and 'bio_lengths' to arrays locating those fields in
+        data_file, all indexed by user ID; fwd_offsets and fwd_targets are
+        the CSR following lists.
+        """
+        self._data_file = data_file
+        self.usernames = usernames
+        self._ids = ids
+        self._known = known
+        self._name_column = columns['name']
+        self._location_column = columns['location']
+        self._web_starts = columns['web_starts']
+        self._web_lengths = columns['web_lengths']
+        self._bio_starts = columns['bio_starts']
+        self._bio_lengths = columns['bio_lengths']
+        self._fwd_offsets = fwd_offsets
+        self._fwd_targets = fwd_targets
+        self._graph = None
+
+    def _read(self, offset, length):
+        """ (CompactTwitterverse, int, int) -> str
+
+        Return the length bytes at offset in the data file, decoded.
+        """
+        if not length:
+            return ''
+        self._data_file.seek(offset)
+        return self._data_file.read(length).decode(ENCODING)
+
+    def __getitem__(self, username):
+        """ (CompactTwitterverse, str) -> CompactProfile
+
+        Return the profile of username.
+        """
+        uid = self._ids.get(username, -1)
+        if not 0 <= uid < self._known:
+            raise KeyError(username)
+        return CompactProfile(self, uid)
+
+    def __contains__(self, username):
+        """ (CompactTwitterverse, object) -> bool """
+        return (isinstance(username, str)
+                and 0 <= self._ids.get(username, -1) < self._known)
+
+    def __iter__(self):
+        """ (CompactTwitterverse) -> iterator of str
+
+        Iterate over the usernames in their original dictionary order.
+        """
+        names = self.usernames
+        return (names[uid] for uid in range(self._known))
+
+    def __len__(self):
+        """ (CompactTwitterverse) -> int """
+        return self._known
+
+    def graph(self):
+        """ (CompactTwitterverse) -> TwitterGraph
+
+        Return a TwitterGraph sharing this Twitterverse's usernames and
+        following arrays.
+        """
+        if self._graph is None:
+            self._graph = csr_graph(self.usernames, self._known,
+                                    self._fwd_offsets, self._fwd_targets,
+                                    self._ids)
+        return self._graph
+
+    def close(self):
+        """ (CompactTwitterverse) -> NoneType
+
+        Close the data file.  Web and bio can no longer be read afterwards.
+        """
+        self._data_file.close()
+
+    def __enter__(self):
+        """ (CompactTwitterverse) -> CompactTwitterverse """
+        return self
+
+    def __exit__(self, *exc_info):
+        """ (CompactTwitterverse, object, object, object) -> NoneType """
+        self.close()
+
+
+def load_compact(path):
+    """ (str) -> CompactTwitterverse
+
+    Return a compact read-only Twitterverse dictionary of the data file at
+    path, equal to the one process_data returns.  Raise DataFormatError as
+    process_data does for a malformed file.
+
+    >>> import os, tempfile
+    >>> from twitterverse_functions import process_data
+    >>> path = os.path.join(tempfile.mkdtemp(), 'data.txt')
+    >>> with open(path, 'w') as data_file:
+    ...     _ = data_file.write('a\\nAnn\\nOz\\nwww.a.com\\nhi\\nthere\\nENDBIO\\n'
+    ...                         'x\\nb\\nEND\\nb\\nBob\\nOz\\n\\nENDBIO\\na\\nEND\\n')
+    >>> twitterverse = load_compact(path)
+    >>> twitterverse['a']['bio'], twitterverse['a']['following']
+    ('hi \\nthere ', ['x', 'b'])
+    >>> twitterverse == process_data(open(path))
+    True
+    >>> twitterverse.graph().followers('a')
+    ['b']
+    >>> twitterverse.close()
+    """
+    data_file = open(path, 'rb')
+    try:
+        # Usernames get provisional IDs in the order they are first seen
+        provisional = _Interner()
+        slots = {}
+        columns = {'name': [], 'location': [], 'web_starts': array('q'),
+                   'web_lengths': array('i'), 'bio_starts': array('q'),
+                   'bio_lengths': array('i')}
+        following_lists = []
+        for username, name, location, web, bio, following in _scan_records(
+                data_file):
+            targets = array('i', map(provisional.__getitem__, following))
+            values = {'name': name, 'location': sys.intern(location),
+                      'web_starts': web[0], 'web_lengths': web[1],
+                      'bio_starts': bio[0], 'bio_lengths': bio[1]}
+            slot = slots.get(username)
+            if slot is None:
+                # A username seen again keeps its first position
+                slot = slots[username] = len(following_lists)
+                following_lists.append(targets)
+                for column, value in values.items():
+                    columns[column].append(value)
+            else:
+                following_lists[slot] = targets
+                for column, value in values.items():
+                    columns[column][slot] = value
+    except BaseException:
+        data_file.close()
+        raise
+
+    # Final IDs follow build_graph: profiles first, then the other usernames
+    # in the order the following lists reach them
+    usernames = list(slots)
+    ids = dict(zip(usernames, range(len(usernames))))
+    seen = list(provisional)
+    final = [-1] * len(seen)
+    for username, uid in ids.items():
+        tid = provisional.get(username)
+        if tid is not None:
+            final[tid] = uid
+    fwd_offsets = array('q', [0])
+    provisional_targets = array('i')
+    for targets in following_lists:
+        provisional_targets.extend(targets)
+        fwd_offsets.append(len(provisional_targets))
+    del following_lists
+    for tid in dict.fromkeys(provisional_targets):
+        if final[tid] < 0:
+            final[tid] = ids[seen[tid]] = len(usernames)
+            usernames.append(seen[tid])
+    fwd_targets = array('i', map(final.__getitem__, provisional_targets))
+    return CompactTwitterverse(data_file, usernames, ids, len(slots), columns,
+                               fwd_offsets, fwd_targets)
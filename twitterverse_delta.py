@@ -0,0 +1,161 @@
+"""
+Incremental updates to a loaded Twitterverse.
+
+A LiveTwitterverse keeps a Twitterverse dictionary, its TwitterGraph and its
+Text index dictionary consistent while users, follow edges and profile
+fields change, so a long-running process can follow a change feed instead of
+reloading the data file.  Each change costs time proportional to the data it
+touches.  The graph's version increases with every change; use it as the
+dataset version of a twitterverse_cache.QueryCache.
+
+Delta files hold one change per line; blank lines and lines starting with
+'#' are ignored.  Fields are separated by single spaces and a field value
+runs to the end of the line, with newlines written as \\n and backslashes
+as \\\\:
+
+    +user <username>
+    -user <username>
+    +follow <username> <username to follow>
+    -follow <username> <username to unfollow>
+    set <username> <name|location|web|bio> <value>
+"""
+
+import re
+
+from twitterverse_functions import DataFormatError
+from twitterverse_graph import build_graph
+from twitterverse_index import build_text_index, distinct_indexes
+
+PROFILE_FIELDS = ('name', 'location', 'web', 'bio')
+
+
+def unescape(value):
+    """ (str) -> str
+
+    Return value with the \\n and \\\\ escapes of a delta file decoded.
+
+    >>> unescape('line one \\\\nline two \\\\\\\\ ')
+    'line one \\nline two \\\\ '
+    """
+    return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) == 'n'
+                  else match.group(1), value)
+
+
+class LiveTwitterverse:
+    """ A Twitterverse dictionary kept in step with its indexes. """
+
+    def __init__(self, twitterverse, graph=None, index=None):
+        """ (LiveTwitterverse, Twitterverse dictionary[, TwitterGraph,
+        Text index dictionary]) -> NoneType
+
+        Initialize live updates of twitterverse, building its graph and text
+        index unless they are given.  twitterverse must be a dict, and graph
+        must have been built by build_graph.
+        """
+        self.twitterverse = twitterverse
+        self.graph = build_graph(twitterverse) if graph is None else graph
+        self.index = build_text_index(twitterverse) if index is None else index
+
+    @property
+    def version(self):
+        """ (LiveTwitterverse) -> int
+
+        Return the number of changes applied so far.
+        """
+        return self.graph.version
+
+    def add_user(self, username):
+        """ (LiveTwitterverse, str) -> NoneType
+
+        Add username with an empty profile.
+        """
+        self.graph.add_user(username)
+        self.twitterverse[username] = {'name': '', 'location': '', 'web': '',
+                                       'bio': '', 'following': []}
+
+    def remove_user(self, username):
+        """ (LiveTwitterverse, str) -> NoneType
+
+        Remove username and its profile.
+        """
+        self.graph.remove_user(username)
+        profile = self.twitterverse.pop(username)
+        for index in distinct_indexes(self.index):
+            index.remove(username, profile[index.field])
+
+    def follow(self, username, target):
+        """ (LiveTwitterverse, str, str) -> NoneType
+
+        Make username follow target.
+        """
+        self.graph.add_edge(username, target)
+        self.twitterverse[username]['following'].append(target)
+
+    def unfollow(self, username, target):
+        """ (LiveTwitterverse, str, str) -> NoneType
+
+        Make username stop following target.
+        """
+        self.graph.remove_edge(username, target)
+        self.twitterverse[username]['following'].remove(target)
+
+    def edit(self, username, field, value):
+        """ (LiveTwitterverse, str, str, str) -> NoneType
+
+        Set field ('name', 'location', 'web' or 'bio') of username's profile
+        to value.
+        """
+        if field not in PROFILE_FIELDS:
+            raise ValueError('unknown profile field: {0!r}'.format(field))
+        profile = self.twitterverse[username]
+        for index in distinct_indexes(self.index):
+            if index.field == field:
+                index.remove(username, profile[field])
+                index.add(username, value)
+        profile[field] = value
+        self.graph.version += 1
+
+    def apply_delta(self, delta_file):
+        """ (LiveTwitterverse, file open for reading) -> int
+
+        Apply every change in delta_file and return how many were applied.
+        Raise DataFormatError, naming the line, for a malformed or
+        inapplicable change; the changes before it stay applied.
+
+        >>> from io import StringIO
+        >>> live = LiveTwitterverse({\
+        'a':{'name':'Ann', 'location':'', 'web':'', 'bio':'', 'following':['b']}, \
+        'b':{'name':'Bob', 'location':'', 'web':'', 'bio':'', 'following':[]}})
+        >>> live.apply_delta(StringIO('+user c\\nset c name Cara Lee\\n'
+        ...                           '+follow c b\\n-follow a b\\n'))
+        4
+        >>> live.graph.followers('b'), live.twitterverse['c']['name']
+        (['c'], 'Cara Lee')
+        >>> sorted(live.index['name-includes'].candidates('Lee'))
+        ['c']
+        """
+        applied = 0
+        for line_no, line in enumerate(delta_file, 1):
+            line = line.rstrip('\r\n')
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            parts = line.split(' ', 3)
+            try:
+                if parts[0] == '+user' and len(parts) == 2:
+                    self.add_user(parts[1])
+                elif parts[0] == '-user' and len(parts) == 2:
+                    self.remove_user(parts[1])
+                elif parts[0] == '+follow' and len(parts) == 3:
+                    self.follow(parts[1], parts[2])
+                elif parts[0] == '-follow' and len(parts) == 3:
+                    self.unfollow(parts[1], parts[2])
+                elif parts[0] == 'set' and len(parts) >= 3:
+                    value = unescape(parts[3]) if len(parts) == 4 else ''
+                    self.edit(parts[1], parts[2], value)
+                else:
+                    raise ValueError('unrecognized change')
+            except (KeyError, ValueError) as error:
+                raise DataFormatError('line {0}: cannot apply {1!r}: {2}'
+                                      .format(line_no, line, error))
+            applied += 1
+        return applied
@@ -0,0 +1,338 @@
+"""
+An inverted index of the words of every user's bio.
+
+BioIndex backs the bio-includes and bio-phrase filters: candidates(value)
+intersects the posting lists of the words of value, so a filter checks the
+bios of the users that contain every word instead of scanning them all.
+
+Each user indexed gets the next document ID, and a word's posting list holds
+the IDs of the users whose bio contains it, in increasing order, stored as
+the differences between consecutive IDs in a variable-length byte code (7
+bits per byte, the high bit set on every byte but the last).  Most
+differences fit in one byte, so a list takes about a byte per user.  A user
+whose bio changes is indexed again under a new document ID; the old one is
+marked deleted and dropped from the postings when deleted IDs outnumber live
+ones.
+
+process_data_indexed builds the index in the same pass over a data file as
+the Twitterverse dictionary.  write stores an index in a file that
+load_bio_index reads back without re-reading any bio.
+
+File layout (native byte order): the HEADER, then for each of SECTIONS its
+length in bytes and its data:
+    - usernames: the username of each document ID, UTF-8, joined by newlines
+    - words: the indexed words, UTF-8, joined by newlines
+    - posting_offsets: where each word's posting list starts in postings,
+      with the end of the last
+    - postings: the concatenated posting lists
+    - last_ids: the last document ID in each word's posting list
+"""
+
+import struct
+from array import array
+
+from twitterverse_functions import bio_words, iter_profiles
+
+MAGIC = b'TWVBIOX1'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sIqq')
+LENGTH = struct.Struct('=q')
+SECTIONS = ('usernames', 'words', 'posting_offsets', 'postings', 'last_ids')
+
+
+class BioIndexError(ValueError):
+    """ Raised when a file is not a bio index this module can read. """
+
+
+def encode_postings(ids):
+    """ (iterable of int) -> bytearray
+
+    Return the posting list of the increasing document IDs ids.
+
+    >>> list(encode_postings([3, 5, 300]))
+    [3, 2, 167, 2]
+    """
+    data = bytearray()
+    last = 0
+    for doc in ids:
+        _append_id(data, doc - last)
+        last = doc
+    return data
+
+
+def _append_id(data, delta):
+    """ (bytearray, int) -> NoneType
+
+    Append the code of the non-negative difference delta to data.
+    """
+    while delta >= 0x80:
+        data.append(delta & 0x7F | 0x80)
+        delta >>= 7
+    data.append(delta)
+
+
+def decode_postings(data):
+    """ (bytes-like) -> generator of int
+
+    Yield the document IDs of the posting list data, in increasing order.
+
+    >>> list(decode_postings(encode_postings([0, 3, 5, 300, 70000])))
+    [0, 3, 5, 300, 70000]
+    """
+    doc = 0
+    delta = 0
+    shift = 0
+    for byte in data:
+        if byte & 0x80:
+            delta |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            doc += delta | byte << shift
+            yield doc
+            delta = shift = 0
+
+
+class BioIndex:
+    """ An inverted index of bio words, for word and phrase matching. """
+
+    field = 'bio'
+
+    def __init__(self, twitterverse=None):
+        """ (BioIndex[, Twitterverse dictionary]) -> NoneType
+
+        Initialize an index of the bio of every user in twitterverse, or an
+        empty index.
+        """
+        self.usernames = []
+        self.doc_ids = {}
+        self.postings = {}
+        self.last_ids = {}
+        self.deleted = 0
+        if twitterverse is not None:
+            for username in twitterverse:
+                self.add(username, twitterverse[username]['bio'])
+
+    def add(self, username, text):
+        """ (BioIndex, str, str) -> NoneType
+
+        Index text as the bio of username, replacing any bio indexed for
+        username before.
+        """
+        if username in self.doc_ids:
+            self.remove(username)
+        doc = len(self.usernames)
+        self.usernames.append(username)
+        self.doc_ids[username] = doc
+        postings = self.postings
+        last_ids = self.last_ids
+        for word in set(bio_words(text)):
+            data = postings.get(word)
+            if data is None:
+                data = postings[word] = bytearray()
+            elif data.__class__ is bytes:
+                # Lists read from a file are bytes until they grow
+                data = postings[word] = bytearray(data)
+            delta = doc - last_ids.get(word, 0)
+            if delta < 0x80:
+                data.append(delta)
+            else:
+                _append_id(data, delta)
+            last_ids[word] = doc
+
+    def remove(self, username, text=None):
+        """ (BioIndex, str[, str]) -> NoneType
+
+        Remove the bio of username from the index.  text, the bio indexed,
+        is accepted for the interface of the other indexes and not needed.
+        """
+        doc = self.doc_ids.pop(username, None)
+        if doc is None:
+            return
+        self.usernames[doc] = None
+        self.deleted += 1
+        if self.deleted > len(self.doc_ids):
+            self.compact()
+
+    def compact(self):
+        """ (BioIndex) -> NoneType
+
+        Renumber the live documents consecutively and drop the deleted ones
+        from every posting list.
+        """
+        if not self.deleted:
+            return
+        renumbered = [-1] * len(self.usernames)
+        live = []
+        for doc, username in enumerate(self.usernames):
+            if username is not None:
+                renumbered[doc] = len(live)
+                live.append(username)
+        postings = {}
+        last_ids = {}
+        for word, data in self.postings.items():
+            ids = [renumbered[doc] for doc in decode_postings(data)
+                   if renumbered[doc] >= 0]
+            if ids:
+                postings[word] = encode_postings(ids)
+                last_ids[word] = ids[-1]
+        self.usernames = live
+        self.doc_ids = dict(zip(live, range(len(live))))
+        self.postings = postings
+        self.last_ids = last_ids
+        self.deleted = 0
+
+    def candidates(self, value):
+        """ (BioIndex, str) -> set of str or NoneType
+
+        Return the users whose bio contains every word of value, or None if
+        value has no words.
+
+        >>> index = BioIndex({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'I love music ', 'following':[]}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'Music lover ', 'following':[]}, \
+        'c':{'name':'', 'location':'', 'web':'', 'bio':'Love me, love my music ', 'following':[]}})
+        >>> sorted(index.candidates('MUSIC')), sorted(index.candidates('love music'))
+        (['a', 'b', 'c'], ['a', 'c'])
+        >>> index.candidates('love guitar'), index.candidates('?')
+        (set(), None)
+        """
+        words = set(bio_words(value))
+        if not words:
+            return None
+        postings = []
+        for word in words:
+            data = self.postings.get(word)
+            if data is None:
+                return set()
+            postings.append(data)
+        # Encoded lengths track list lengths, so start from the shortest and
+        # stop decoding each longer list past the last ID still wanted
+        postings.sort(key=len)
+        docs = set(decode_postings(postings[0]))
+        for data in postings[1:]:
+            last = max(docs)
+            found = set()
+            for doc in decode_postings(data):
+                if doc > last:
+                    break
+                if doc in docs:
+                    found.add(doc)
+            docs = found
+            if not docs:
+                break
+        usernames = self.usernames
+        return {usernames[doc] for doc in docs
+                if usernames[doc] is not None}
+
+    def write(self, path):
+        """ (BioIndex, str) -> NoneType
+
+        Compact the index and write it to the file at path.
+        """
+        self.compact()
+        words = list(self.postings)
+        posting_offsets = array('q', [0])
+        size = 0
+        for word in words:
+            size += len(self.postings[word])
+            posting_offsets.append(size)
+        sections = {
+            'usernames': '\n'.join(self.usernames).encode('utf-8'),
+            'words': '\n'.join(words).encode('utf-8'),
+            'posting_offsets': posting_offsets,
+            'postings': b''.join(self.postings[word] for word in words),
+            'last_ids': array('q', [self.last_ids[word] for word in words])}
+        with open(path, 'wb') as index_file:
+            index_file.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK,
+                                         len(self.usernames), len(words)))
+            for section in SECTIONS:
+                data = bytes(sections[section])
+                index_file.write(LENGTH.pack(len(data)))
+                index_file.write(data)
+
+
+def _lines(data, count):
+    """ (bytes, int) -> list of str
+
+    Return the count strings joined by newlines in the UTF-8 bytes data.
+    """
+    return data.decode('utf-8').split('\n') if count else []
+
+
+def load_bio_index(path):
+    """ (str) -> BioIndex
+
+    Return the BioIndex written to the file at path by BioIndex.write.
+    Raise BioIndexError if the file is not one.
+
+    >>> import os, tempfile
+    >>> index = BioIndex({\
+    'a':{'name':'', 'location':'', 'web':'', 'bio':'Café owner ', 'following':[]}, \
+    'b':{'name':'', 'location':'', 'web':'', 'bio':'café regular ', 'following':[]}})
+    >>> index.add('a', 'Retired ')
+    >>> path = os.path.join(tempfile.mkdtemp(), 'bio.idx')
+    >>> index.write(path)
+    >>> loaded = load_bio_index(path)
+    >>> sorted(loaded.candidates('CAFÉ')), loaded.candidates('owner')
+    (['b'], set())
+    >>> loaded.add('c', 'café owner ')
+    >>> sorted(loaded.candidates('café'))
+    ['b', 'c']
+    """
+    with open(path, 'rb') as index_file:
+        data = index_file.read()
+    if len(data) < HEADER.size:
+        raise BioIndexError('{0!r} is not a bio index'.format(path))
+    magic, mark, documents, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise BioIndexError('{0!r} is not a bio index'.format(path))
+    if mark != BYTE_ORDER_MARK:
+        raise BioIndexError('{0!r} was written with another byte order'
+                            .format(path))
+    sections = {}
+    position = HEADER.size
+    for section in SECTIONS:
+        if position + LENGTH.size > len(data):
+            raise BioIndexError('{0!r} is truncated'.format(path))
+        size, = LENGTH.unpack_from(data, position)
+        position += LENGTH.size
+        if position + size > len(data):
+            raise BioIndexError('{0!r} is truncated'.format(path))
+        sections[section] = data[position:position + size]
+        position += size
+
+    index = BioIndex()
+    index.usernames = _lines(sections['usernames'], documents)
+    index.doc_ids = dict(zip(index.usernames, range(documents)))
+    words = _lines(sections['words'], count)
+    offsets = array('q', sections['posting_offsets'])
+    postings = sections['postings']
+    index.postings = {word: postings[offsets[k]:offsets[k + 1]]
+                      for k, word in enumerate(words)}
+    index.last_ids = dict(zip(words, array('q', sections['last_ids'])))
+    return index
+
+
+def process_data_indexed(data_file):
+    """ (file open for reading) -> tuple of (Twitterverse dictionary,
+    BioIndex)
+
+    Return the Twitterverse dictionary process_data returns for data_file and
+    a BioIndex of its bios, built in the same pass over the file.
+
+    >>> from io import StringIO
+    >>> twitterverse, index = process_data_indexed(StringIO(\
+    'a\\nAnn\\nOz\\n\\nLoves jazz\\nENDBIO\\nEND\\n'\
+    'b\\nBob\\n\\n\\nJazz drummer\\nENDBIO\\na\\nEND\\n'))
+    >>> twitterverse['b']['following'], sorted(index.candidates('jazz'))
+    (['a'], ['a', 'b'])
+    """
+    twitterverse = {}
+    index = BioIndex()
+    for username, name, location, web, bio, following in iter_profiles(
+            data_file):
+        twitterverse[username] = {'name': name, 'location': location,
+                                  'web': web, 'bio': bio,
+                                  'following': following}
+        index.add(username, bio)
+    return twitterverse, index
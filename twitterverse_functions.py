@@ -19,59 +19,135 @@ Query dictionary: dict of {str: dict of {str: object}}
 
 Search specification dictionary: dict of {str: object}
    - key "username", value represents the username to begin search at (a str)
-   - key "operations", value represents the operations to perform (a list of str)
+   - key "operations", value represents the operations to perform (a list of str):
+     "followers", "following", "similar" (the users following the most
+     similar accounts) or "recommend" (accounts to follow, from those the
+     most similar users follow); see twitterverse_similar.  The last two
+     need a TwitterGraph
 
 Filter specification dictionary: dict of {str: str}
    - key "following" might exist, value represents a username (a str)
    - key "follower" might exist, value represents a username (a str)
    - key "name-includes" might exist, value represents a str to match (a case-insensitive match)
    - key "location-includes" might exist, value represents a str to match (a case-insensitive match)
+   - key "bio-includes" might exist, value represents words that must all
+     appear as words of the bio, ignoring case (a str)
+   - key "bio-phrase" might exist, value represents words that must appear
+     consecutively among the words of the bio, ignoring case (a str)
 
 Presentation specification dictionary: dict of {str: str}
-   - key "sort-by", value represents how to sort results (a str)
-   - key "format", value represents how to format results (a str)
+   - key "sort-by", value represents how to sort results: "popularity",
+     "username", "name" or "influence", which needs a TwitterGraph (a str)
+   - key "format", value represents how to format results: "short", "long",
+     "count" (the number of results) or "approx-count" (an estimate of it)
+     (a str)
+   - key "limit" might exist, value represents the maximum number of results
+     to present (a str of digits)
+
+Trace dictionary: dict of {str: object}, filled in by run_query
+   - key "stages", value maps "search", "filter", "sort", "format" and
+     "present" (sort plus format) to their wall time in seconds
+     (a dict of {str: float})
+   - key "frontier_sizes", value represents the number of users after each
+     search operation (a list of int)
+   - key "filter_dropped", value maps each filter key to the number of users
+     it removed (a dict of {str: int})
+   - key "sort_comparisons", value represents the number of comparisons made
+     while sorting (an int)
+   - key "results", value represents the number of users after filtering
+     (an int)
+   - key "presented", value represents the number of users presented (an int)
+   - key "output_size", value represents the length of the output (an int)
        
 """
 
+import heapq
+import re
+import time
+from functools import cmp_to_key
+
+from twitterverse_influence import influence
+from twitterverse_similar import SIMILARITY_OPERATIONS
+from twitterverse_sketch import estimate_reach
+
+COUNT_FORMATS = ('count', 'approx-count')
+FILTER_KEYS = ('name-includes', 'following', 'follower', 'location-includes',
+               'bio-includes', 'bio-phrase')
+
 # Write your Twitterverse functions here
 
+class DataFormatError(ValueError):
+    """ Raised when a Twitterverse data file contains a malformed record. """
+
+
+def iter_profiles(data_file, first_line=1):
+    ''' (file open for reading[, int]) -> generator of list
+    
+    Yield [username, name, location, web, bio, following] for each user in
+    data_file, reading one line at a time. Each bio line is followed by a
+    space and a newline, except that the final newline is dropped. Raise
+    DataFormatError, naming the line, if a record is malformed or truncated;
+    lines are numbered from first_line.
+    
+    >>> from io import StringIO
+    >>> data = StringIO('a\\nA\\nOz\\n\\nhi\\nthere\\nENDBIO\\nb\\nEND\\n')
+    >>> list(iter_profiles(data))
+    [['a', 'A', 'Oz', '', 'hi \\nthere ', ['b']]]
+    >>> try:
+    ...     list(iter_profiles(StringIO('a\\nA\\nOz\\n\\nhi\\n')))
+    ... except DataFormatError as error:
+    ...     print(error)
+    line 5: record 'a' starting at line 1 is truncated (expected ENDBIO)
+    '''
+    info = []
+    bio = []
+    following = None
+    start = 0
+    line_no = 0
+    for line_no, line in enumerate(data_file, first_line):
+        line = line.rstrip()
+        if following is not None:
+            if line == 'END':
+                info.append(following)
+                yield info
+                info = []
+                following = None
+            else:
+                following.append(line)
+        elif len(info) < 4:
+            if line == 'ENDBIO' or line == 'END':
+                raise DataFormatError('line {0}: unexpected {1} in the header '
+                                      'of the record starting at line {2}'
+                                      .format(line_no, line, start or line_no))
+            if not info:
+                start = line_no
+            info.append(line)
+        elif line == 'ENDBIO':
+            info.append(' \n'.join(bio) + ' ' if bio else '')
+            bio = []
+            following = []
+        else:
+            bio.append(line)
+    if info:
+        expected = 'END' if following is not None else 'ENDBIO'
+        raise DataFormatError('line {0}: record {1!r} starting at line {2} is '
+                              'truncated (expected {3})'
+                              .format(line_no, info[0], start, expected))
+
 def twitterverse_helper(data_file):
     ''' (file open for reading) -> list of lists 
      Return a list of lists of the data for each user.
     
     '''
-    y = []
-    for i in data_file.readlines():
-        y.append(i.rstrip())    
-    
-    profile_of_users = []
-    
-    while y != []:
-        info = []
-        info.extend(y[0:4])
-        bio1 = ''
-        for b in y[4:y.index('ENDBIO')]:
-            bio1 = bio1 + b + ' ' +'\n' # enters a new line after every submission
-        bio1 = bio1[0:-1]
-        info.append(bio1)            
-        following = []
-        for f in y[y.index('ENDBIO')+1:y.index('END')]:
-            following.append(f)
-        info.append(following)
-        profile_of_users.append(info)
-        z = y.index('END')
-        del y[0:z+1]
-        
-    return profile_of_users
+    return list(iter_profiles(data_file))
         
 def process_data(data_file):
     '''(file open for reading)->dict of{str:dict of{str:object}}
     Return the data in the Twitterverse dictionary format. 
     
     '''    
-    user_list = twitterverse_helper(data_file)
     twitterverse = {}
-    for user in user_list:
+    for user in iter_profiles(data_file):
         twitterverse[user[0]] = {}
         twitterverse[user[0]]['name'] = user[1]
         twitterverse[user[0]]['location'] = user[2]
@@ -120,14 +196,9 @@ def filterq(search,z) :
     lst = {}
     a = search
     for x in range(z.index('FILTER'),z.index('PRESENT')):
-        if 'name-includes' in z[x]:
-            lst['name-includes']=z[x][z[x].index(' ')+1:]
-        if 'following' in z[x] :
-            lst['following'] = z[x][z[x].index(' ') + 1 : ]
-        if 'follower' in z[x] :
-            lst['follower'] = z[x][z[x].index(' ') + 1 : ]
-        if 'location-includes' in z[x] :
-            lst['location-includes'] = z[x][z[x].index(' ') + 1 : ]
+        key, space, value = z[x].partition(' ')
+        if space and key in FILTER_KEYS :
+            lst[key] = value
     a['filter'] = lst
     return a 
 
@@ -149,6 +220,11 @@ def presentq(filter,a):
             lst['format'] = 'long'
         if 'short' in a[x] :
                 lst['format'] = 'short' 
+        if a[x].startswith('format') and a[x].endswith('count') :
+            lst['format'] = a[x][ a[x].index(' ') + 1 : ]
+        if a[x].startswith('limit') :
+            lst['limit'] = a[x][ a[x].index(' ') + 1 : ]
+            present_limit(lst)
     c['present'] = lst
     return c
     
@@ -164,10 +240,12 @@ def process_query(query) :
     
     return new_lst
     
-def all_followers(twitterverse,user):
-    """ (dict of {str: dict of {str: object}}, str) -> lst of str
+def all_followers(twitterverse,user,graph=None):
+    """ (dict of {str: dict of {str: object}}, str[, TwitterGraph]) -> lst of str
     
     Return the list of followers of the user from twitterverse dictionary.
+    If graph, a TwitterGraph built from twitterverse, is given, use its
+    reverse index instead of scanning every user.
     
     >>> all_followers({'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
     'following': [], 'location': '', 'bio': ''},\
@@ -186,6 +264,8 @@ def all_followers(twitterverse,user):
     , 'web': 'http://www.tomcruise.com'}},'tomCruise')
     ['PerezHilton']
     """
+    if graph is not None:
+        return graph.followers(user)
     new_lst=[]
     for i in twitterverse:
         for j in twitterverse[i]['following']:
@@ -193,12 +273,32 @@ def all_followers(twitterverse,user):
                 new_lst=new_lst+[i]
     return new_lst
 
-def get_search_results(twitterverse,search):
-    """ (dict of {str: dict of {str: object}}, dict of {str : object})
-    -> list of str
+def search_operations(search):
+    """ (dict of {str : object}) -> list of str
+    
+    Return the operations of search. Raise ValueError if there are none,
+    so every search path rejects a query file with no operation lines.
+    
+    >>> search_operations({'username': 'a', 'operations': ['followers']})
+    ['followers']
+    >>> search_operations({'username': 'a', 'operations': []})
+    Traceback (most recent call last):
+    ...
+    ValueError: a search needs at least one operation
+    """
+    operations = search['operations']
+    if not operations:
+        raise ValueError('a search needs at least one operation')
+    return operations
+
+def get_search_results(twitterverse,search,graph=None,trace=None):
+    """ (dict of {str: dict of {str: object}}, dict of {str : object}
+    [, TwitterGraph, Trace dictionary]) -> list of str
     
     Return the list of str after search specification extracted from search
-    and data from twitterverse dictionary.
+    and data from twitterverse dictionary. If graph, a TwitterGraph built from
+    twitterverse, is given, follow its adjacency arrays instead. If trace is
+    given, record the frontier size after each operation in it.
        
     >>> a = {'PerezHilton': {'location': 'Hollywood, California', 'name':\
     'Perez Hilton', 'following': ['tomCruise', 'katieH', 'NicoleKidman'],\
@@ -232,25 +332,64 @@ def get_search_results(twitterverse,search):
     'username': 'tomCruise'}
     >>> get_search_results(a,b)
     []
+    >>> from twitterverse_graph import build_graph
+    >>> b = {'operations': ['followers', 'following'], 'username': 'tomCruise'}
+    >>> get_search_results(a,b,build_graph(a)) == get_search_results(a,b)
+    True
+    >>> get_search_results(a,b,build_graph(a))
+    ['tomCruise', 'katieH', 'NicoleKidman']
+    >>> get_search_results(a, {'operations': ['similar'], 'username':\
+    'tomCruise'}, build_graph(a))
+    ['PerezHilton']
+    >>> get_search_results(a, {'operations': ['similar'], 'username': 'tomCruise'})
+    Traceback (most recent call last):
+    ...
+    ValueError: 'similar' searches need a TwitterGraph
     
     """
-    lst=[]
+    sizes = None
+    if trace is not None:
+        sizes = trace.setdefault('frontier_sizes', [])
+    operations = search_operations(search)
+    if graph is not None:
+        return graph.search(search['username'], operations, sizes)
+    for operation in operations:
+        # The MinHash index is cached per graph, so building one per
+        # search would rebuild the index every time
+        if operation in SIMILARITY_OPERATIONS:
+            raise ValueError('{0!r} searches need a TwitterGraph'
+                             .format(operation))
     
-    if search['operations'][0]=='followers':
-        lst.extend(all_followers(twitterverse,search['username']))
-    elif search['operations'][0]=='following':
-        lst.extend(twitterverse[search['username']]['following'])
+    neighbours = {'followers': lambda f: all_followers(twitterverse, f),
+                  'following': lambda f: twitterverse[f]['following']}
+    lst = [search['username']]
+    for x in operations:
+        if lst != []:
+            if x not in neighbours:
+                raise ValueError('unknown search operation: {0!r}'.format(x))
+            lst = expand_frontier(lst, neighbours[x])
+        if sizes is not None:
+            sizes.append(len(lst))
+    return lst
+
+def expand_frontier(lst, neighbours):
+    """ (list of str, function) -> list of str
     
-    for x in search['operations'][1:]:
-        for f in lst:
-            if x=='followers':
-                lst[lst.index(f):lst.index(f)+1] =[all_followers(twitterverse,f)]
-            
-            elif x=='following':
-                lst[lst.index(f):lst.index(f)+1]=[twitterverse[f]['following']]
-                
-        lst=helper_search(lst)
-    return rmv_dup(lst) #removes the list after removing duplicates
+    Return the distinct users that neighbours returns for the users in lst,
+    in the order they are first seen. Deduplicating at every hop keeps the
+    order rmv_dup would give after the final hop.
+    
+    >>> expand_frontier(['a', 'b', 'a'], lambda f: {'a': ['x', 'y'], 'b': ['y', 'z']}[f])
+    ['x', 'y', 'z']
+    """
+    seen = set()
+    output = []
+    for f in lst:
+        for x in neighbours(f):
+            if x not in seen:
+                seen.add(x)
+                output.append(x)
+    return output
 
 def helper_search(lst):
     """ (list of list of int) -> list of int
@@ -279,18 +418,136 @@ def rmv_dup(lst):
     >>> rmv_dup([3, 2, 6, 4,5])
     [3, 2, 6, 4, 5]
     """
+    seen = set()
     output = []
     for x in lst:
-        if x not in output:
+        if x not in seen:
+            seen.add(x)
             output.append(x)
     return output
     
-def get_filter_results(twitterverse, lst, filterd) :
-    """ (dict of {str: dict of {str: object}}, list of str, dict of {str : str})
-    -> list of str
+def compile_filter(twitterverse, filterd, graph=None, index=None):
+    """ (dict of {str: dict of {str: object}}, dict of {str : str}
+    [, TwitterGraph, Text index dictionary]) -> function
+    
+    Return a predicate that is True for the users that pass every filter in
+    filterd. The neighbour sets for 'follower' and 'following' are built
+    once (the latter from graph's reverse index, if given), and the
+    candidate sets from index are checked before any profile is read.
+    
+    >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+    'following': [], 'location': '', 'bio': ''},\
+    'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+    'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+    >>> keep = compile_filter(a, {'follower': 'tomCruise', 'name-includes': 'K'})
+    >>> keep('katieH'), keep('tomCruise')
+    (True, False)
+    """
+    tests = [test for key, test in filter_tests(twitterverse, filterd, graph,
+                                                index)]
+    return lambda j: all(test(j) for test in tests)
+
+def filter_tests(twitterverse, filterd, graph=None, index=None):
+    """ (dict of {str: dict of {str: object}}, dict of {str : str}
+    [, TwitterGraph, Text index dictionary]) -> list of tuple of (str, function)
+    
+    Return the tests that compile_filter combines, in the order it applies
+    them, each with the filter key it checks.  A user without a profile
+    fails every test that reads one, whether or not graph or index is given.
+    
+    >>> a = {'a': {'web': '', 'name': 'A', 'following': ['ghost'],\
+    'location': '', 'bio': ''}, 'b': {'web': '', 'name': 'B', 'following':\
+    [], 'location': '', 'bio': ''}}
+    >>> from twitterverse_graph import build_graph
+    >>> [[test('ghost') for key, test in filter_tests(a, {'following': 'b',\
+    'name-includes': 'G'}, graph)] for graph in (None, build_graph(a))]
+    [[False, False], [False, False]]
+    """
+    membership = []
+    substrings = []
+    if 'follower' in filterd:
+        name = filterd['follower']
+        if graph is not None:
+            followed = set(graph.following(name))
+        else:
+            followed = set(twitterverse[name]['following'])
+        membership.append(('follower', followed.__contains__))
+    if 'following' in filterd:
+        name = filterd['following']
+        if graph is not None:
+            followers = set(graph.followers(name))
+            membership.append(('following', followers.__contains__))
+        else:
+            substrings.append(('following', lambda j: j in twitterverse and
+                               name in twitterverse[j]['following']))
+    for key, field, matches in TEXT_FILTERS:
+        if key in filterd:
+            value = filterd[key]
+            if index is not None and key in index:
+                candidates = index[key].candidates(value)
+                if candidates is not None:
+                    membership.append((key, candidates.__contains__))
+            substrings.append((key, lambda j, field=field, value=value,
+                               matches=matches: j in twitterverse and
+                               matches(twitterverse[j][field], value)))
+    return membership + substrings
+
+def bio_words(text):
+    """ (str) -> list of str
+    
+    Return the words of text in order, lowercased: its runs of letters,
+    digits and underscores.
+    
+    >>> bio_words("Tom Cruise's #1 fan")
+    ['tom', 'cruise', 's', '1', 'fan']
+    """
+    return re.findall(r'\w+', text.lower())
+
+def includes_words(text, value):
+    """ (str, str) -> bool
+    
+    Return True iff every word of value is a word of text, ignoring case.
+    
+    >>> includes_words('Official TomCruise.com crew', 'CREW official')
+    True
+    >>> includes_words('Official TomCruise.com crew', 'cruise')
+    False
+    """
+    return set(bio_words(value)).issubset(bio_words(text))
+
+def includes_phrase(text, value):
+    """ (str, str) -> bool
+    
+    Return True iff the words of value appear consecutively, in order,
+    among the words of text, ignoring case and punctuation.
+    
+    >>> includes_phrase('We love you guys! Visit us', 'you, guys. visit')
+    True
+    >>> includes_phrase('We love you guys! Visit us', 'love guys')
+    False
+    """
+    # Words never contain spaces, so a phrase match is a substring match on
+    # the words joined by single spaces
+    phrase = ' '.join(bio_words(value))
+    return not phrase or (' ' + phrase + ' ' in
+                          ' ' + ' '.join(bio_words(text)) + ' ')
+
+TEXT_FILTERS = (('name-includes', 'name', str.__contains__),
+                ('location-includes', 'location', str.__contains__),
+                ('bio-includes', 'bio', includes_words),
+                ('bio-phrase', 'bio', includes_phrase))
+
+def get_filter_results(twitterverse, lst, filterd, graph=None, index=None,
+                       trace=None) :
+    """ (dict of {str: dict of {str: object}}, list of str, dict of {str : str}
+    [, TwitterGraph, Text index dictionary, Trace dictionary]) -> list of str
     
     Return list of str after filter specification taken from filterd,
-    data taken from twitterverse dictionary is performed on lst.
+    data taken from twitterverse dictionary is performed on lst. All filters
+    are applied in a single pass; see compile_filter for graph and index.
+    If trace is given, the filters still run in one pass, and each user
+    dropped is charged to the first filter key it fails; the number of users
+    each key drops is recorded in it.
     
     >>> a = {'tomfan': {'location': 'Houston, Texas', 'name': 'Chris\
     Calderone', 'bio': 'Tom Cruise is the best actor in Hollywood',\
@@ -320,39 +577,38 @@ def get_filter_results(twitterverse, lst, filterd) :
     ['tomCruise']
     
     """
-    new_lst = lst[:]
-    for b in filterd :
-        if b == 'location-includes':
-            for j in lst :
-                location = twitterverse[j]['location']
-                location1 = filterd[b]
-                if location1 not in location :
-                    new_lst.remove(j)
-        elif b == 'name-includes' :
-            for j  in lst :
-                name = twitterverse[j]['name']
-                name1 = filterd[b]
-                if name1 not in name :
-                    new_lst.remove(j)
-        elif b == 'following' :
-            for j in lst :
-                following = twitterverse[j]['following']
-                name = filterd[b]
-                if name not in following :
-                    new_lst.remove(j)
-        elif b == 'follower' :
-            for j in lst :
-                name = filterd[b]
-                following = twitterverse[name]['following']
-                if j not in following :
-                    new_lst.remove(j)
-    return new_lst
+    if lst == [] or filterd == {}:
+        if trace is not None:
+            trace.setdefault('filter_dropped', {}).update(dict.fromkeys(filterd,
+                                                                        0))
+        return lst[:]
+    if trace is not None:
+        # Charge each user dropped to the first test it fails
+        dropped = trace.setdefault('filter_dropped', {})
+        dropped.update(dict.fromkeys(filterd, 0))
+        tests = filter_tests(twitterverse, filterd, graph, index)
+        new_lst = []
+        for j in lst:
+            for b, test in tests:
+                if not test(j):
+                    dropped[b] += 1
+                    break
+            else:
+                new_lst.append(j)
+        return new_lst
+    keep = compile_filter(twitterverse, filterd, graph, index)
+    return [j for j in lst if keep(j)]
 
-def get_present_string(twitterverse, users, present):
-    """ (dict of {str :{str : object}},list of str, dict of {str: object})->str.
+def get_present_string(twitterverse, users, present, graph=None, trace=None):
+    """ (dict of {str :{str : object}},list of str, dict of {str: object}
+    [, TwitterGraph, Trace dictionary])->str.
     
     Return str according to present on users and relevent data taken from
-    twitterverse.
+    twitterverse. If present has a limit N, only the first N users in sorted
+    order are presented, selected with a heap instead of a full sort. If
+    graph is given, popularity is read from its follower counts. If trace is
+    given, record the sorting and formatting times, the number of sort key
+    comparisons and the number of users presented in it.
     
     >>> a = {'gerrypower': {'location': 'Toronto, Ontario', 'name':\
     'Gerry Power', 'following': ['kenstruys', 'drscan', 'chanian',\
@@ -380,50 +636,371 @@ def get_present_string(twitterverse, users, present):
     >>> presentation = {'sort-by': 'username', 'format': 'short'}
     >>> get_present_string(twitter, usernames, presentation)
     "['katieH', 'tomCruise']"
+    >>> presentation = {'sort-by': 'popularity', 'format': 'short', 'limit': '1'}
+    >>> get_present_string(twitter, usernames, presentation)
+    "['katieH']"
+    >>> get_present_string(twitter, usernames, {'sort-by': 'name', 'format': 'count'})
+    '2'
     
     """
+    if present['format'] in COUNT_FORMATS:
+        count = present_count(len(users), present)
+        if trace is not None:
+            trace['presented'] = count
+        return str(count)
 
-    lst = users[:]
+    lst = present_order(twitterverse, users, present, graph, trace)
+    
     if lst == [] and present['format'] == 'long' :
         return '----------\n----------'
     elif lst == [] and present['format'] == 'short' : #if the format is short
         return []                                     # return empty list
-    
-    if present['sort-by'] == 'popularity':
-        tweet_sort(twitterverse, lst, more_popular)
-        for i in range(len(lst)):
-            if len(lst) > 1 and lst[i] == lst[i - 1]:
-                if username_first(twitterverse, lst[i], lst[i - 1]) == -1:
-                    lst[i],lst[i - 1] = lst[i - 1],lst[i]
                     
-    elif present['sort-by'] == 'username':
-        tweet_sort(twitterverse, lst, username_first)
-        
-    elif present['sort-by'] == 'name':
-        tweet_sort(twitterverse, lst, name_first)
-        for i in range(len(lst)-1):
-            if lst[i] == lst[i+1]:
-                if username_first(twitterverse, lst[i], lst[i+1])==1:
-                    lst[i],lst[i+1]=lst[i+1],lst[i]
-                    
-    if present['format'] == 'short':
-        return str(lst)
+    if present['format'] in ('short', 'long'):
+        return ''.join(present_chunks(twitterverse, lst, present['format']))
+
+def present_limit(present):
+    """ (dict of {str: object}) -> int or NoneType
+    
+    Return the limit of present, or None if it has none. Raise ValueError
+    if the limit is not a non-negative whole number.
+    
+    >>> present_limit({'format': 'short', 'limit': '3'})
+    3
+    >>> present_limit({'format': 'short', 'limit': '-1'})
+    Traceback (most recent call last):
+    ...
+    ValueError: limit must be a non-negative whole number: '-1'
+    """
+    if 'limit' not in present:
+        return None
+    limit = present['limit']
+    if not (isinstance(limit, str) and limit.isdigit() and limit.isascii()):
+        raise ValueError('limit must be a non-negative whole number: {0!r}'
+                         .format(limit))
+    return int(limit)
+
+def present_count(count, present):
+    """ (int, dict of {str: object}) -> int
+    
+    Return how many of count results present presents, given its limit.
+    """
+    limit = present_limit(present)
+    if limit is not None:
+        return min(count, limit)
+    return count
+
+def present_order(twitterverse, users, present, graph=None, trace=None):
+    """ (dict of {str :{str : object}}, list of str, dict of {str: object}
+    [, TwitterGraph, Trace dictionary]) -> list of str
+    
+    Return users in the order, and up to the limit, that present gives,
+    as get_present_string presents them.  Fewer than two users are left
+    unsorted, so their keys are never read, as in the comparison sort.
     
-    if present['format'] == 'long':
-        st = '----------'
+    >>> present_order({}, ['ghost'], {'sort-by': 'name', 'format': 'short'})
+    ['ghost']
+    """
+    if trace is not None:
+        start = time.perf_counter()
+    key = sort_key(twitterverse, users, present['sort-by'], graph)
+    if trace is not None and key is not None:
+        key = counted_key(key, trace)
+    limit = present_limit(present)
+    if key is None or len(users) < 2:
+        lst = users[:limit]
+    elif limit is None:
+        lst = sorted(users, key=key)
+    else:
+        lst = heapq.nsmallest(limit, users, key=key)
+    if trace is not None:
+        trace.setdefault('stages', {})['sort'] = time.perf_counter() - start
+        trace['presented'] = len(lst)
+    return lst
+
+def present_chunks(twitterverse, lst, form):
+    """ (dict of {str :{str : object}}, list of str, str) -> generator of str
+    
+    Yield the form ('short' or 'long') presentation of the non-empty list
+    of users lst, one user at a time.
+    
+    >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+    'following': [], 'location': '', 'bio': ''}}
+    >>> list(present_chunks(a, ['katieH', 'katieH'], 'short'))
+    ['[', "'katieH'", ", 'katieH'", ']']
+    """
+    if form == 'short':
+        yield '['
+        separator = ''
+        for i in lst:
+            yield separator + repr(i)
+            separator = ', '
+        yield ']'
+    
+    elif form == 'long':
+        yield '----------'
         for i in lst:
-            st+= '\n' +i+'\nname: '+twitterverse[i]['name']+'\nlocation: '+\
-            twitterverse[i]['location']+'\nwebsite: '+twitterverse[i]['web']+\
-            '\nbio:\n'+twitterverse[i]['bio']+'\nfollowing: '+\
-            str(twitterverse[i]['following'])+'\n----------'
-        return st+'\n'
+            profile = twitterverse[i]
+            following = profile['following']
+            if isinstance(following, list):
+                following = '[' + ', '.join(map(repr, following)) + ']'
+            yield ('\n' + i + '\nname: ' + profile['name'] +
+                   '\nlocation: ' + profile['location'] +
+                   '\nwebsite: ' + profile['web'] + '\nbio:\n' +
+                   profile['bio'] + '\nfollowing: ' + str(following) +
+                   '\n----------')
+        yield '\n'
+
+def iter_present_string(twitterverse, users, present, graph=None, offset=0,
+                        limit=None):
+    """ (dict of {str :{str : object}}, list of str, dict of {str: object}
+    [, TwitterGraph, int, int]) -> generator of str
+    
+    Yield the presentation of users in chunks, one user at a time, so the
+    first bytes are ready at once and the whole presentation is never held
+    in memory. Joined, the chunks equal str(get_present_string(...)). If
+    offset or limit is given, present only limit users (all, if None) from
+    position offset of the sorted users.
+    
+    >>> twitter =  {'katieH': {'web': 'www.tomkat.com', 'bio': '',\
+    'following': [], 'name': 'Katie Holmes', 'location':''},\
+    'tomCruise': {'web': 'http://www.tomcruise.com', 'bio': '',\
+    'following': ['katieH'], 'name': 'Tom Cruise', 'location': ''}}
+    >>> presentation = {'sort-by': 'username', 'format': 'short'}
+    >>> ''.join(iter_present_string(twitter, ['tomCruise', 'katieH'], presentation, offset=1))
+    "['tomCruise']"
+    """
+    if present['format'] in COUNT_FORMATS:
+        count = max(0, present_count(len(users), present) - offset)
+        yield str(count if limit is None else min(count, limit))
+        return
+    lst = present_order(twitterverse, users, present, graph)
+    if offset or limit is not None:
+        lst = lst[offset:] if limit is None else lst[offset:offset + limit]
+    if lst == [] and present['format'] == 'long':
+        yield '----------\n----------'
+    elif lst == [] and present['format'] == 'short':
+        yield '[]'
+    else:
+        yield from present_chunks(twitterverse, lst, present['format'])
+
+def write_present_string(twitterverse, users, present, output, graph=None,
+                         offset=0, limit=None):
+    """ (dict of {str :{str : object}}, list of str, dict of {str: object},
+    file open for writing[, TwitterGraph, int, int]) -> int
+    
+    Write the presentation of users to output as it is produced, paged as
+    for iter_present_string, and return the number of characters written.
+    """
+    written = 0
+    for chunk in iter_present_string(twitterverse, users, present, graph,
+                                     offset, limit):
+        output.write(chunk)
+        written += len(chunk)
+    return written
+
+def run_query(twitterverse, query, graph=None, index=None, trace=None):
+    """ (Twitterverse dictionary, Query dictionary[, TwitterGraph,
+    Text index dictionary, Trace dictionary]) -> str
+    
+    Return the presentation of the results of query on twitterverse: the
+    search results, filtered, then presented. If trace is given, record the
+    cost of each stage in it.
+    
+    >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+    'following': [], 'location': '', 'bio': ''},\
+    'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+    'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+    >>> query = {'search': {'username': 'katieH', 'operations': ['followers']},\
+    'filter': {}, 'present': {'sort-by': 'username', 'format': 'short'}}
+    >>> run_query(a, query)
+    "['tomCruise']"
+    >>> trace = {}
+    >>> run_query(a, query, trace=trace)
+    "['tomCruise']"
+    >>> trace['frontier_sizes'], trace['results'], trace['output_size']
+    ([1], 1, 13)
+    """
+    if graph is not None and query['present']['format'] in COUNT_FORMATS:
+        return count_results(twitterverse, query, graph, index, trace)
+    if trace is None:
+        results = get_search_results(twitterverse, query['search'], graph)
+        results = get_filter_results(twitterverse, results, query['filter'],
+                                     graph, index)
+        return get_present_string(twitterverse, results, query['present'],
+                                  graph)
+    
+    stages = trace.setdefault('stages', {})
+    start = time.perf_counter()
+    results = get_search_results(twitterverse, query['search'], graph, trace)
+    stages['search'] = time.perf_counter() - start
+    start = time.perf_counter()
+    results = get_filter_results(twitterverse, results, query['filter'],
+                                 graph, index, trace)
+    stages['filter'] = time.perf_counter() - start
+    trace['results'] = len(results)
+    start = time.perf_counter()
+    output = get_present_string(twitterverse, results, query['present'],
+                                graph, trace)
+    stages['present'] = time.perf_counter() - start
+    stages['format'] = stages['present'] - stages.get('sort', 0.0)
+    trace['output_size'] = len(str(output))
+    return output
+            
+def count_results(twitterverse, query, graph, index=None, trace=None):
+    """ (Twitterverse dictionary, Query dictionary, TwitterGraph
+    [, Text index dictionary, Trace dictionary]) -> str
+    
+    Return the presentation of query, whose format is 'count' or
+    'approx-count', on twitterverse, counting the filtered search results
+    in graph without listing or sorting them. An 'approx-count' with no
+    filter is estimated from sketches instead (see twitterverse_sketch).
+    If trace is given, record the cost of each stage in it.
+    
+    >>> from twitterverse_graph import build_graph
+    >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+    'following': [], 'location': '', 'bio': ''},\
+    'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+    'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+    >>> query = {'search': {'username': 'tomCruise', 'operations':\
+    ['following', 'followers']}, 'filter': {}, 'present': {'sort-by':\
+    'username', 'format': 'count'}}
+    >>> count_results(a, query, build_graph(a))
+    '1'
+    """
+    search = query['search']
+    filterd = query['filter']
+    present = query['present']
+    operations = search_operations(search)
+    sizes = None
+    if trace is not None:
+        stages = trace.setdefault('stages', {})
+        sizes = trace.setdefault('frontier_sizes', [])
+    start = time.perf_counter()
+    if present['format'] == 'approx-count' and filterd == {}:
+        count = estimate_reach(graph, search['username'], operations)
+        reached = None
+    else:
+        reached = graph.reach_ids(search['username'], operations, sizes)
+        count = len(reached)
+    if trace is not None:
+        stages['search'] = time.perf_counter() - start
+        start = time.perf_counter()
+    if reached and filterd != {}:
+        keep = compile_filter(twitterverse, filterd, graph, index)
+        names = graph.names
+        count = sum(1 for uid in reached if keep(names[uid]))
+    output = str(present_count(count, present))
+    if trace is not None:
+        stages['filter'] = time.perf_counter() - start
+        stages['present'] = stages['format'] = 0.0
+        trace['results'] = count
+        trace['presented'] = int(output)
+        trace['output_size'] = len(output)
+    return output
             
 # --- Sorting Helper Functions ---
+def follower_counts(twitter_data, users, graph=None):
+    """ (Twitterverse dictionary, list of str[, TwitterGraph]) -> dict of {str: int}
+    
+    Return the number of followers of each user in users, counted in a single
+    pass over twitter_data (or read from graph, if given).
+    
+    >>> twitter_data = {\
+    'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}, \
+    'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':[]}, \
+    'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}}
+    >>> follower_counts(twitter_data, ['a', 'b'])
+    {'a': 0, 'b': 2}
+    """
+    if graph is not None:
+        return {user: graph.follower_count(user) for user in users}
+    counts = dict.fromkeys(users, 0)
+    for i in twitter_data:
+        for j in twitter_data[i]['following']:
+            if j in counts:
+                counts[j] += 1
+    return counts
+
+def sort_key(twitter_data, users, sort_by, graph=None):
+    """ (Twitterverse dictionary, list of str, str[, TwitterGraph]) -> function
+    
+    Return a key function that orders users the way tweet_sort orders them
+    with the comparison function for sort_by ('popularity', 'username' or
+    'name'), or by decreasing influence (see twitterverse_influence) for
+    'influence', breaking ties by username.  Return None to leave the order
+    unchanged for any other sort_by.  Influence is computed over the whole
+    graph and cached until it changes, so 'influence' needs graph; raise
+    ValueError without it.
+    
+    >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+    'following': [], 'location': '', 'bio': ''},\
+    'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+    'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+    >>> from twitterverse_graph import build_graph
+    >>> sorted(['tomCruise', 'katieH'], key=sort_key(a, [], 'influence',\
+    build_graph(a)))
+    ['katieH', 'tomCruise']
+    >>> sort_key(a, [], 'influence')
+    Traceback (most recent call last):
+    ...
+    ValueError: sorting by influence needs a TwitterGraph
+    """
+    if sort_by == 'popularity':
+        counts = follower_counts(twitter_data, users, graph)
+        return lambda user: (-counts[user], user)
+    if sort_by == 'influence':
+        if graph is None:
+            raise ValueError('sorting by influence needs a TwitterGraph')
+        scores = influence(graph)
+        ids = graph.ids
+        return lambda user: (-scores[ids[user]], user)
+    if sort_by == 'username':
+        return lambda user: user
+    if sort_by == 'name':
+        return lambda user: (twitter_data[user]['name'], user)
+    return None
+
+class _CountedKey:
+    """ A sort key that counts the comparisons made with it. """
+    
+    __slots__ = ('value', 'trace')
+    
+    def __init__(self, value, trace):
+        """ (_CountedKey, object, Trace dictionary) -> NoneType """
+        self.value = value
+        self.trace = trace
+    
+    def __lt__(self, other):
+        """ (_CountedKey, _CountedKey) -> bool """
+        self.trace['sort_comparisons'] += 1
+        return self.value < other.value
+    
+    def __eq__(self, other):
+        """ (_CountedKey, _CountedKey) -> bool """
+        return self.value == other.value
+
+def counted_key(key, trace):
+    """ (function, Trace dictionary) -> function
+    
+    Return key wrapped so that every comparison between the keys it returns
+    is counted in trace['sort_comparisons'].
+    
+    >>> trace = {}
+    >>> sorted(['c', 'a', 'b'], key=counted_key(lambda user: user, trace))
+    ['a', 'b', 'c']
+    >>> trace['sort_comparisons'] > 0
+    True
+    """
+    trace.setdefault('sort_comparisons', 0)
+    return lambda user: _CountedKey(key(user), trace)
+
 def tweet_sort(twitter_data, results, cmp):
     """ (Twitterverse dictionary, list of str, function) -> NoneType
     
     Sort the results list using the comparison function cmp and the data in 
-    twitter_data.
+    twitter_data. The sort is stable; more_popular, username_first and
+    name_first are sorted by precomputed keys instead of comparisons.
     
     >>> twitter_data = {\
     'a':{'name':'Zed', 'location':'', 'web':'', 'bio':'', 'following':[]}, \
@@ -438,14 +1015,14 @@ def tweet_sort(twitter_data, results, cmp):
     ['b', 'a', 'c']
     """
     
-    # Insertion sort
-    for i in range(1, len(results)):
-        current = results[i]
-        position = i
-        while position > 0 and cmp(twitter_data, results[position - 1], current) > 0:
-            results[position] = results[position - 1]
-            position = position - 1 
-        results[position] = current  
+    if len(results) < 2:
+        return
+    sort_by = {more_popular: 'popularity', username_first: 'username',
+               name_first: 'name'}.get(cmp)
+    if sort_by is not None:
+        results.sort(key=sort_key(twitter_data, results, sort_by))
+    else:
+        results.sort(key=cmp_to_key(lambda a, b: cmp(twitter_data, a, b)))
             
 def more_popular(twitter_data, a, b):
     """ (Twitterverse dictionary, str, str) -> int
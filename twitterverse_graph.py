@@ -0,0 +1,575 @@
+"""
+Indexed follow graph for a Twitterverse dictionary.
+
+A TwitterGraph is built once from the output of process_data and stores the
+follow relation as compressed sparse row (CSR) arrays over integer user IDs,
+in both directions, so that followers and following lookups cost O(degree)
+instead of a scan over every user.
+
+User IDs are assigned in Twitterverse dictionary order; usernames that only
+appear inside "following" lists (and have no profile) are interned after
+them.  Followers of a user are stored in ascending ID order, which is the
+order all_followers reports them in.
+
+The graph can also be edited in place (see twitterverse_delta), and every
+change bumps version.  An edited user's following list moves out of the CSR
+arrays into a Python list.  Follower lists stay in the CSR arrays: each
+user's followers added since, sorted by rank, and the number of times each
+follower was removed are kept beside them and merged in when the list is
+read, so an edit costs time proportional to the change rather than to the
+followers the user has.  The degree sums the query planner estimates from
+are likewise kept up to date by each edit once computed.  Users added later rank after every existing user,
+as they would in a dictionary, and follower lists stay in rank order.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+
+from twitterverse_similar import similarity_index
+
+
+class TwitterGraph:
+    """ Forward and reverse adjacency of a Twitterverse dictionary. """
+
+    def __init__(self, names, has_profile, fwd_offsets, fwd_targets,
+                 rev_offsets, rev_sources, ids=None):
+        """ (TwitterGraph, list of str, bytearray, array, array, array, array
+        [, dict of {str: int}]) -> NoneType
+
+        Initialize a graph over the usernames names, where has_profile[i] is
+        1 iff names[i] is a key of the Twitterverse dictionary, and the
+        following (fwd) and followers (rev) relations are CSR arrays.  ids
+        maps each username to its index in names and is derived from names
+        if omitted.
+        """
+        self.names = names
+        if ids is None:
+            ids = {name: i for i, name in enumerate(names)}
+        self.ids = ids
+        self.has_profile = has_profile
+        self.fwd_offsets = fwd_offsets
+        self.fwd_targets = fwd_targets
+        self.rev_offsets = rev_offsets
+        self.rev_sources = rev_sources
+        self.version = 0
+        self._base = len(fwd_offsets) - 1
+        self._following = {}
+        self._added_followers = {}
+        self._removed_followers = {}
+        self._ranks = {}
+        self._next_rank = len(names)
+        self._degree_sums = None
+
+    def __len__(self):
+        """ (TwitterGraph) -> int
+
+        Return the number of users with a profile in this graph.
+        """
+        return sum(self.has_profile)
+
+    def __contains__(self, username):
+        """ (TwitterGraph, str) -> bool
+
+        Return True iff username has a profile in this graph.
+        """
+        uid = self.ids.get(username)
+        return uid is not None and self.has_profile[uid] == 1
+
+    def user_id(self, username):
+        """ (TwitterGraph, str) -> int
+
+        Return the integer ID of username, or -1 if it never appears.
+        """
+        return self.ids.get(username, -1)
+
+    def following_ids(self, uid):
+        """ (TwitterGraph, int) -> array of int
+
+        Return the IDs of the users that user uid is following.
+        """
+        edited = self._following.get(uid)
+        if edited is not None:
+            return edited
+        return self.fwd_targets[self.fwd_offsets[uid]:self.fwd_offsets[uid + 1]]
+
+    def follower_ids(self, uid):
+        """ (TwitterGraph, int) -> array of int
+
+        Return the IDs of the followers of user uid, in Twitterverse order.
+        """
+        followers = self._csr_follower_ids(uid)
+        removed = self._removed_followers.get(uid)
+        if removed:
+            removed = dict(removed)
+            kept = []
+            for source in followers:
+                if removed.get(source):
+                    removed[source] -= 1
+                else:
+                    kept.append(source)
+            followers = kept
+        added = self._added_followers.get(uid)
+        if added:
+            # Followers left in the CSR arrays rank by their ID
+            merged = []
+            start = 0
+            for rank, source in added:
+                end = bisect_right(followers, rank, start)
+                merged.extend(followers[start:end])
+                merged.append(source)
+                start = end
+            merged.extend(followers[start:])
+            followers = merged
+        return followers
+
+    def edited_following(self):
+        """ (TwitterGraph) -> dict of {int: list of int}
+
+        Return the following lists of the users edited since the graph was
+        built, keyed by user ID.  They replace those users' entries in
+        fwd_offsets and fwd_targets, which cover the first
+        len(fwd_offsets) - 1 users.  While it is empty, the CSR arrays in
+        both directions are exactly the follow relation of the graph.
+
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':[]}})
+        >>> graph.edited_following()
+        {}
+        >>> graph.add_edge('b', 'a'); graph.edited_following()
+        {1: [0]}
+        """
+        return {uid: list(following)
+                for uid, following in self._following.items()}
+
+    def _csr_follower_ids(self, uid):
+        """ (TwitterGraph, int) -> array of int
+
+        Return the IDs of the followers of user uid in the CSR arrays.
+        """
+        if uid >= len(self.rev_offsets) - 1:
+            return self.rev_sources[:0]
+        return self.rev_sources[self.rev_offsets[uid]:self.rev_offsets[uid + 1]]
+
+    def following(self, username):
+        """ (TwitterGraph, str) -> list of str
+
+        Return the usernames username is following, like
+        twitterverse[username]['following'].  Raise KeyError if username has
+        no profile.
+        """
+        if username not in self:
+            raise KeyError(username)
+        names = self.names
+        return [names[i] for i in self.following_ids(self.ids[username])]
+
+    def followers(self, username):
+        """ (TwitterGraph, str) -> list of str
+
+        Return the followers of username in the same order as all_followers.
+        """
+        uid = self.ids.get(username)
+        if uid is None:
+            return []
+        names = self.names
+        return [names[i] for i in self.follower_ids(uid)]
+
+    def following_count(self, username):
+        """ (TwitterGraph, str) -> int
+
+        Return the number of entries in username's following list.
+        """
+        uid = self.ids.get(username)
+        if uid is None:
+            return 0
+        if uid in self._following:
+            return len(self._following[uid])
+        return self.fwd_offsets[uid + 1] - self.fwd_offsets[uid]
+
+    def follower_count(self, username):
+        """ (TwitterGraph, str) -> int
+
+        Return the number of followers of username.
+        """
+        uid = self.ids.get(username)
+        if uid is None:
+            return 0
+        return self._follower_count(uid)
+
+    def _follower_count(self, uid):
+        """ (TwitterGraph, int) -> int
+
+        Return the number of followers of user uid.
+        """
+        return (len(self._csr_follower_ids(uid))
+                - sum(self._removed_followers.get(uid, {}).values())
+                + len(self._added_followers.get(uid, ())))
+
+    def degree_sums(self):
+        """ (TwitterGraph) -> tuple of int
+
+        Return the number of follow edges, of users following someone, of
+        users with a follower, and the sums of the squared following and
+        follower counts.  They are computed in one pass on first use and
+        then updated by every edit.
+
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b', 'c']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['c']}})
+        >>> graph.degree_sums()
+        (3, 2, 2, 5, 5)
+        >>> graph.add_edge('b', 'a'); graph.remove_user('a'); graph.degree_sums()
+        (2, 1, 2, 4, 2)
+        """
+        if self._degree_sums is None:
+            sums = [0] * 5
+            for uid in range(len(self.names)):
+                out_degree = len(self.following_ids(uid))
+                in_degree = self._follower_count(uid)
+                sums[0] += out_degree
+                sums[1] += out_degree > 0
+                sums[2] += in_degree > 0
+                sums[3] += out_degree * out_degree
+                sums[4] += in_degree * in_degree
+            self._degree_sums = sums
+        return tuple(self._degree_sums)
+
+    def _shift_degree(self, following, before, after):
+        """ (TwitterGraph, bool, int, int) -> NoneType
+
+        Update the degree sums for a user whose following count, if
+        following, or follower count changed from before to after.
+        """
+        sums = self._degree_sums
+        if sums is None:
+            return
+        if following:
+            sums[0] += after - before
+        k = 1 if following else 2
+        sums[k] += (after > 0) - (before > 0)
+        sums[k + 2] += after * after - before * before
+
+    def _rank(self, uid):
+        """ (TwitterGraph, int) -> int
+
+        Return the position of user uid in Twitterverse dictionary order.
+        """
+        return self._ranks.get(uid, uid)
+
+    def _intern(self, username):
+        """ (TwitterGraph, str) -> int
+
+        Return the ID of username, interning it without a profile if new.
+        """
+        uid = self.ids.get(username)
+        if uid is None:
+            uid = self.ids[username] = len(self.names)
+            self.names.append(username)
+            self.has_profile.append(0)
+            self._following[uid] = []
+        return uid
+
+    def _edit_following(self, uid):
+        """ (TwitterGraph, int) -> list of int
+
+        Return the editable following list of user uid.
+        """
+        if uid not in self._following:
+            self._following[uid] = list(self.following_ids(uid))
+        return self._following[uid]
+
+    def _drop_follower(self, target, source, count=None):
+        """ (TwitterGraph, int, int[, int]) -> NoneType
+
+        Remove count occurrences of user source, or all of them if count is
+        None, from the followers of user target.  Those added since the CSR
+        arrays were built go first.
+        """
+        added = self._added_followers.get(target, [])
+        rank = self._rank(source)
+        start = bisect_left(added, (rank,))
+        end = bisect_left(added, (rank + 1,))
+        if count is not None:
+            end = min(end, start + count)
+            count -= end - start
+        del added[start:end]
+        if count is None:
+            followers = self._csr_follower_ids(target)
+            count = (bisect_right(followers, source)
+                     - bisect_left(followers, source))
+            removed = self._removed_followers.get(target, {})
+            count -= removed.get(source, 0)
+        if count:
+            removed = self._removed_followers.setdefault(target, {})
+            removed[source] = removed.get(source, 0) + count
+
+    def add_user(self, username):
+        """ (TwitterGraph, str) -> NoneType
+
+        Give username a profile that follows no one.  Raise ValueError if it
+        already has one.
+        """
+        if username in self:
+            raise ValueError('user {0!r} already exists'.format(username))
+        uid = self._intern(username)
+        self.has_profile[uid] = 1
+        self._following[uid] = []
+        self._ranks[uid] = self._next_rank
+        self._next_rank += 1
+        self.version += 1
+
+    def remove_user(self, username):
+        """ (TwitterGraph, str) -> NoneType
+
+        Remove the profile of username and the users it follows.  Users who
+        follow username keep it in their following lists, as they would in
+        the Twitterverse dictionary.
+
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b', 'b']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':[]}, \
+        'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}})
+        >>> graph.remove_user('a'); graph.add_user('a'); graph.add_edge('a', 'b')
+        >>> graph.followers('b'), graph.follower_count('b')
+        (['c', 'a'], 2)
+        """
+        if username not in self:
+            raise KeyError(username)
+        uid = self.ids[username]
+        following = self.following_ids(uid)
+        for target, count in Counter(following).items():
+            before = self._follower_count(target)
+            self._drop_follower(target, uid)
+            self._shift_degree(False, before, before - count)
+        self._shift_degree(True, len(following), 0)
+        self._following[uid] = []
+        self.has_profile[uid] = 0
+        self.version += 1
+
+    def add_edge(self, username, target):
+        """ (TwitterGraph, str, str) -> NoneType
+
+        Append target to the following list of username.
+
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':[]}, \
+        'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}})
+        >>> graph.add_user('d'); graph.add_edge('d', 'b'); graph.add_edge('b', 'b')
+        >>> graph.remove_edge('a', 'b')
+        >>> graph.followers('b'), graph.follower_count('b'), graph.version
+        (['b', 'c', 'd'], 3, 4)
+        """
+        if username not in self:
+            raise KeyError(username)
+        uid = self.ids[username]
+        target_id = self._intern(target)
+        following = self._edit_following(uid)
+        followers = self._follower_count(target_id)
+        following.append(target_id)
+        insort(self._added_followers.setdefault(target_id, []),
+               (self._rank(uid), uid))
+        self._shift_degree(True, len(following) - 1, len(following))
+        self._shift_degree(False, followers, followers + 1)
+        self.version += 1
+
+    def remove_edge(self, username, target):
+        """ (TwitterGraph, str, str) -> NoneType
+
+        Remove the first occurrence of target from the following list of
+        username.  Raise ValueError if username does not follow target.
+        """
+        if username not in self:
+            raise KeyError(username)
+        uid = self.ids[username]
+        target_id = self.ids.get(target)
+        following = self._edit_following(uid)
+        if target_id is None or target_id not in following:
+            raise ValueError('{0!r} does not follow {1!r}'.format(username,
+                                                                 target))
+        followers = self._follower_count(target_id)
+        following.remove(target_id)
+        self._drop_follower(target_id, uid, 1)
+        self._shift_degree(True, len(following) + 1, len(following))
+        self._shift_degree(False, followers, followers - 1)
+        self.version += 1
+
+    def _profile_following_ids(self, uid):
+        """ (TwitterGraph, int) -> array of int
+
+        Return following_ids(uid), raising KeyError if user uid has no
+        profile to follow anyone from.
+        """
+        if not self.has_profile[uid]:
+            raise KeyError(self.names[uid])
+        return self.following_ids(uid)
+
+    def _step(self, operation):
+        """ (TwitterGraph, str) -> function
+
+        Return the function from a user ID to the IDs one operation
+        ('followers', 'following', 'similar' or 'recommend') away from it.
+        """
+        if operation == 'followers':
+            return self.follower_ids
+        if operation == 'following':
+            return self._profile_following_ids
+        if operation == 'similar':
+            return similarity_index(self).similar_ids
+        if operation == 'recommend':
+            return similarity_index(self).recommend_ids
+        raise ValueError('unknown search operation: {0!r}'.format(operation))
+
+    def expand(self, frontier, operation):
+        """ (TwitterGraph, list of int, str) -> list of int
+
+        Return the distinct IDs one operation (see _step) away from the IDs
+        in frontier, in the order they are first reached.
+        """
+        step = self._step(operation)
+        seen = set()
+        reached = []
+        for uid in frontier:
+            for neighbour in step(uid):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    reached.append(neighbour)
+        return reached
+
+    def search_ids(self, username, operations, sizes=None):
+        """ (TwitterGraph, str, list of str[, list of int]) -> list of int
+
+        Return the IDs reached from username by applying operations in turn,
+        deduplicated at every hop and in first-seen order.  If sizes is
+        given, append the size of the frontier after each operation to it.
+        """
+        uid = self.ids.get(username)
+        if uid is None and operations[:1] == ['following']:
+            raise KeyError(username)
+        frontier = [] if uid is None else [uid]
+        for operation in operations:
+            if frontier:
+                frontier = self.expand(frontier, operation)
+            if sizes is not None:
+                sizes.append(len(frontier))
+        return frontier
+
+    def reach_ids(self, username, operations, sizes=None):
+        """ (TwitterGraph, str, list of str[, list of int]) -> set of int
+
+        Return the set of IDs search_ids(username, operations) returns,
+        without ordering them.  sizes is as for search_ids.
+
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b', 'c']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['c']}, \
+        'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['a']}})
+        >>> sorted(graph.reach_ids('c', ['followers', 'followers']))
+        [0, 2]
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['c', 'b']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['x']}, \
+        'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['y']}})
+        >>> graph.reach_ids('a', ['following', 'following', 'following'])
+        Traceback (most recent call last):
+        ...
+        KeyError: 'y'
+        """
+        if 'following' in operations[1:]:
+            # A 'following' step fails on the first user without a profile
+            # in search order, so walk the frontier in that order
+            return set(self.search_ids(username, operations, sizes))
+        uid = self.ids.get(username)
+        if uid is None and operations[:1] == ['following']:
+            raise KeyError(username)
+        frontier = set() if uid is None else {uid}
+        for operation in operations:
+            if frontier:
+                step = self._step(operation)
+                reached = set()
+                for uid in frontier:
+                    reached.update(step(uid))
+                frontier = reached
+            if sizes is not None:
+                sizes.append(len(frontier))
+        return frontier
+
+    def search(self, username, operations, sizes=None):
+        """ (TwitterGraph, str, list of str[, list of int]) -> list of str
+
+        Return the usernames reached from username by applying operations in
+        turn, in the order get_search_results reports them.  sizes is as for
+        search_ids.
+
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b', 'c']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['a', 'c']}, \
+        'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['a']}})
+        >>> graph.search('a', ['following', 'following'])
+        ['a', 'c']
+        >>> graph.search('c', ['followers', 'followers', 'following'])
+        ['a', 'c', 'b']
+        """
+        names = self.names
+        return [names[i] for i in self.search_ids(username, operations, sizes)]
+
+
+def build_graph(twitterverse):
+    """ (Twitterverse dictionary) -> TwitterGraph
+
+    Return a TwitterGraph indexing the follow relation of twitterverse.
+
+    >>> twitterverse = {\
+    'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b', 'x']}, \
+    'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['a']}, \
+    'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}}
+    >>> graph = build_graph(twitterverse)
+    >>> graph.followers('b')
+    ['a', 'c']
+    >>> graph.following('a')
+    ['b', 'x']
+    >>> graph.follower_count('x'), 'x' in graph, len(graph)
+    (1, False, 3)
+    """
+    names = list(twitterverse)
+    ids = {name: i for i, name in enumerate(names)}
+    fwd_offsets = array('q', [0])
+    fwd_targets = array('i')
+    for username in twitterverse:
+        for target in twitterverse[username]['following']:
+            uid = ids.get(target)
+            if uid is None:
+                uid = ids[target] = len(names)
+                names.append(target)
+            fwd_targets.append(uid)
+        fwd_offsets.append(len(fwd_targets))
+    return csr_graph(names, len(twitterverse), fwd_offsets, fwd_targets, ids)
+
+
+def csr_graph(names, known, fwd_offsets, fwd_targets, ids=None):
+    """ (list of str, int, array, array[, dict of {str: int}]) -> TwitterGraph
+
+    Return a TwitterGraph over the usernames names, of which the first known
+    have profiles, whose following lists are the CSR arrays fwd_offsets
+    (with known + 1 entries) and fwd_targets.  fwd_offsets is extended to
+    cover the users without a profile.  ids is as for TwitterGraph.
+    """
+    has_profile = bytearray([1]) * known + bytearray(len(names) - known)
+    fwd_offsets.extend([fwd_offsets[-1]] * (len(names) - known))
+
+    # Counting sort on the target IDs gives each follower list in source order
+    rev_offsets = array('q', bytes(8 * (len(names) + 1)))
+    for target in fwd_targets:
+        rev_offsets[target + 1] += 1
+    for i in range(len(names)):
+        rev_offsets[i + 1] += rev_offsets[i]
+    rev_sources = array('i', bytes(4 * len(fwd_targets)))
+    fill = rev_offsets[:-1]
+    for source in range(known):
+        for k in range(fwd_offsets[source], fwd_offsets[source + 1]):
+            target = fwd_targets[k]
+            rev_sources[fill[target]] = source
+            fill[target] += 1
+    return TwitterGraph(names, has_profile, fwd_offsets, fwd_targets,
+                        rev_offsets, rev_sources, ids)
@@ -0,0 +1,110 @@
+"""
+Text indexes for the substring filters of a Twitterverse query.
+
+A Text index dictionary maps a filter key to an index over the profile field
+that filter matches:
+
+Text index dictionary: dict of {str: NgramIndex or BioIndex}
+   - key "name-includes", value indexes each user's "name"
+   - key "location-includes", value indexes each user's "location"
+   - keys "bio-includes" and "bio-phrase", values are one
+     twitterverse_fulltext.BioIndex of each user's "bio"
+
+Each index answers candidates(value) with a set of usernames that contains
+every user the filter would keep, or None when it cannot narrow the search;
+the filter still checks each candidate, so an index never changes results.
+Every index has the profile field it covers as its field attribute, and
+add and remove methods to keep it up to date.
+"""
+
+from twitterverse_fulltext import BioIndex
+
+
+class NgramIndex:
+    """ An n-gram index over one profile field, for substring matching. """
+
+    def __init__(self, twitterverse, field, n=3):
+        """ (NgramIndex, Twitterverse dictionary, str[, int]) -> NoneType
+
+        Initialize an index of the length-n substrings of field for every
+        user in twitterverse.
+        """
+        self.field = field
+        self.n = n
+        self.postings = {}
+        for username in twitterverse:
+            self.add(username, twitterverse[username][field])
+
+    def _grams(self, text):
+        """ (NgramIndex, str) -> set of str
+
+        Return the distinct length-n substrings of text.
+        """
+        n = self.n
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def add(self, username, text):
+        """ (NgramIndex, str, str) -> NoneType
+
+        Index text as the value of this field for username.
+        """
+        for gram in self._grams(text):
+            self.postings.setdefault(gram, set()).add(username)
+
+    def remove(self, username, text):
+        """ (NgramIndex, str, str) -> NoneType
+
+        Remove text, previously added for username, from the index.
+        """
+        for gram in self._grams(text):
+            users = self.postings.get(gram)
+            if users is not None:
+                users.discard(username)
+                if not users:
+                    del self.postings[gram]
+
+    def candidates(self, value):
+        """ (NgramIndex, str) -> set of str or NoneType
+
+        Return the users whose field may contain value, or None if value is
+        shorter than the n-grams of this index.
+
+        >>> index = NgramIndex({\
+        'a':{'name':'Tom Cruise', 'location':'', 'web':'', 'bio':'', 'following':[]}, \
+        'b':{'name':'Katie Holmes', 'location':'', 'web':'', 'bio':'', 'following':[]}}, \
+        'name')
+        >>> index.candidates('Cruise'), index.candidates('Hol'), index.candidates('e')
+        ({'a'}, {'b'}, None)
+        """
+        if len(value) < self.n:
+            return None
+        postings = sorted((self.postings.get(gram, set())
+                           for gram in self._grams(value)), key=len)
+        return postings[0].intersection(*postings[1:])
+
+
+def build_text_index(twitterverse, n=3, bio_index=None):
+    """ (Twitterverse dictionary[, int, BioIndex]) -> Text index dictionary
+
+    Return n-gram indexes for the name-includes and location-includes filters
+    over twitterverse, and bio_index, or a new BioIndex of twitterverse, for
+    the bio-includes and bio-phrase filters.
+
+    >>> index = build_text_index({\
+    'a':{'name':'Ann', 'location':'', 'web':'', 'bio':'Jazz fan ', 'following':[]}})
+    >>> index['bio-includes'] is index['bio-phrase'], index['bio-phrase'].candidates('jazz')
+    (True, {'a'})
+    """
+    if bio_index is None:
+        bio_index = BioIndex(twitterverse)
+    return {'name-includes': NgramIndex(twitterverse, 'name', n),
+            'location-includes': NgramIndex(twitterverse, 'location', n),
+            'bio-includes': bio_index, 'bio-phrase': bio_index}
+
+
+def distinct_indexes(index):
+    """ (Text index dictionary) -> list of NgramIndex or BioIndex
+
+    Return each index in index once, although several keys may share it.
+    """
+    return list({id(value): value for value in index.values()}.values())
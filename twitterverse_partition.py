@@ -0,0 +1,462 @@
+"""
+A Twitterverse split across worker processes by username hash.
+
+A PartitionedTwitterverse runs shards worker processes on this machine.  The
+user with a given username is owned by shard zlib.crc32(username) % shards,
+which holds that user's profile and the list of their followers; no process
+holds the whole Twitterverse dictionary.  Every worker reads the whole data
+file but keeps only what it owns, so with a CPU per worker loading takes
+about as long as process_data while memory is split between the workers.
+The owners of usernames that appear more than once tell the other workers
+which of their records counts, so that follower lists match process_data's.
+
+A query runs in the coordinator (the process that created the
+PartitionedTwitterverse), which talks to the workers over pipes:
+    - search: each operation is a bulk-synchronous step.  The frontier is
+      sent to the shards that own its users, each shard returns their
+      neighbours, and the coordinator merges them in frontier order.
+    - filter: each result is checked by the shard that owns it, and the
+      coordinator keeps the results that pass, in order.
+    - present: the coordinator sorts the results with the follower counts or
+      names their owners report, and formats them with the profiles of the
+      users presented.
+
+run_query returns exactly what twitterverse_functions.run_query returns for
+the dictionary process_data reads from the same file, including the
+KeyError or ValueError it raises for an invalid query.  approx-count is
+counted exactly, as run_query does without a graph.  Sorting by influence
+and the similarity search operations need the whole graph, so they raise
+ValueError here.
+
+    python twitterverse_partition.py data.txt query.txt --shards 4
+"""
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import zlib
+
+from twitterverse_functions import (COUNT_FORMATS, filter_tests,
+                                    get_present_string, iter_profiles,
+                                    present_count, present_limit,
+                                    process_query, search_operations)
+from twitterverse_similar import SIMILARITY_OPERATIONS
+
+
+def owner(username, shards):
+    """ (str, int) -> int
+
+    Return the number of the shard, out of shards, that owns username.
+
+    >>> owner('tomCruise', 4), owner('NicoleKidman', 4)
+    (3, 1)
+    """
+    return zlib.crc32(username.encode('utf-8')) % shards
+
+
+class _Shard:
+    """ The users a worker process owns, with their followers. """
+
+    def __init__(self, path, shard, shards):
+        """ (_Shard, str, int, int) -> NoneType
+
+        Read the users owned by shard, out of shards, from the data file at
+        path, and the follow edges that point at them.
+        """
+        self.profiles = {}
+        self._followers = {}
+        self.duplicates = {}
+        first = {}
+        with open(path) as data_file:
+            for record, user in enumerate(iter_profiles(data_file)):
+                username, following = user[0], user[5]
+                if owner(username, shards) == shard:
+                    self.profiles[username] = {
+                        'name': user[1], 'location': user[2], 'web': user[3],
+                        'bio': user[4], 'following': following}
+                    if username in first:
+                        self.duplicates[username] = (first[username], record)
+                    else:
+                        first[username] = record
+                for target in following:
+                    if owner(target, shards) == shard:
+                        self._followers.setdefault(target, []).append(
+                            (record, username))
+
+    def finish(self, duplicates):
+        """ (_Shard, dict of {str: tuple of (int, int)}) -> NoneType
+
+        Put each follower list in dictionary order, given the first and
+        last record of every username that appears more than once.  Only
+        the last record of such a user follows anyone, and it ranks at the
+        first.
+        """
+        for target, followers in self._followers.items():
+            ranked = []
+            for record, username in followers:
+                if username in duplicates:
+                    first, last = duplicates[username]
+                    if record != last:
+                        continue
+                    record = first
+                ranked.append((record, username))
+            ranked.sort(key=lambda pair: pair[0])
+            self._followers[target] = [username for record, username in ranked]
+
+    def size(self):
+        """ (_Shard) -> int
+
+        Return the number of users this shard owns.
+        """
+        return len(self.profiles)
+
+    def expand(self, usernames, operation):
+        """ (_Shard, list of str, str) -> list of list of str or NoneType
+
+        Return, for each of usernames in turn, the neighbours one operation
+        away that no earlier user in usernames reached, or None for a user
+        without a profile when operation is 'following'.
+        """
+        seen = set()
+        neighbours = []
+        for username in usernames:
+            if operation == 'followers':
+                users = self._followers.get(username, [])
+            elif username in self.profiles:
+                users = self.profiles[username]['following']
+            else:
+                neighbours.append(None)
+                continue
+            reached = []
+            for user in users:
+                if user not in seen:
+                    seen.add(user)
+                    reached.append(user)
+            neighbours.append(reached)
+        return neighbours
+
+    def filter(self, usernames, filterd, followed):
+        """ (_Shard, list of str, Filter specification dictionary, set of
+        str or NoneType) -> list of bool
+
+        Return whether each of usernames passes filterd, where followed is
+        the set of users that the "follower" user follows.
+        """
+        local = dict(filterd)
+        local.pop('follower', None)
+        tests = [test for key, test in filter_tests(self.profiles, local)]
+        if followed is not None:
+            tests.insert(0, followed.__contains__)
+        return [all(test(username) for test in tests)
+                for username in usernames]
+
+    def follower_counts(self, usernames):
+        """ (_Shard, list of str) -> list of int
+
+        Return the number of followers of each of usernames.
+        """
+        followers = self._followers
+        return [len(followers.get(username, ())) for username in usernames]
+
+    def fields(self, usernames, fields):
+        """ (_Shard, list of str, tuple of str) -> list of dict or NoneType
+
+        Return the given profile fields of each of usernames, or None for a
+        user without a profile.
+        """
+        profiles = self.profiles
+        return [{field: profiles[username][field] for field in fields}
+                if username in profiles else None for username in usernames]
+
+
+def _serve(connection, path, shard, shards):
+    """ (Connection, str, int, int) -> NoneType
+
+    Load shard and answer the coordinator's commands on connection until it
+    sends 'close'.  Each reply is ('ok', result) or ('error', exception).
+    """
+    try:
+        store = _Shard(path, shard, shards)
+        reply = ('ok', store.duplicates)
+    except Exception as error:
+        reply = ('error', error)
+    connection.send(reply)
+    while True:
+        command, arguments = connection.recv()
+        if command == 'close':
+            break
+        try:
+            reply = ('ok', getattr(store, command)(*arguments))
+        except Exception as error:
+            reply = ('error', error)
+        connection.send(reply)
+    connection.close()
+
+
+class PartitionedTwitterverse:
+    """ A Twitterverse held by worker processes, queried from this one. """
+
+    def __init__(self, path, shards=None):
+        """ (PartitionedTwitterverse, str[, int]) -> NoneType
+
+        Load the data file at path into shards worker processes (one per
+        CPU by default).  Raise DataFormatError as process_data does for a
+        malformed file.
+        """
+        self.shards = shards or os.cpu_count() or 1
+        # Workers are spawned so that the coordinator can be any process,
+        # including one that runs threads
+        context = multiprocessing.get_context('spawn')
+        self._connections = []
+        self._workers = []
+        try:
+            for shard in range(self.shards):
+                connection, child = context.Pipe()
+                worker = context.Process(target=_serve,
+                                         args=(child, path, shard,
+                                               self.shards),
+                                         daemon=True)
+                worker.start()
+                child.close()
+                self._connections.append(connection)
+                self._workers.append(worker)
+            duplicates = {}
+            for found in self._replies():
+                duplicates.update(found)
+            self._call('finish', [(duplicates,)] * self.shards)
+        except BaseException:
+            self.close()
+            raise
+
+    def _replies(self):
+        """ (PartitionedTwitterverse) -> list of object
+
+        Return the reply of every shard, in shard order, raising the first
+        error any shard replied with once all have replied.
+        """
+        replies = [connection.recv() for connection in self._connections]
+        for status, result in replies:
+            if status == 'error':
+                raise result
+        return [result for status, result in replies]
+
+    def _call(self, command, arguments):
+        """ (PartitionedTwitterverse, str, list of tuple) -> list of object
+
+        Run command on every shard at once, with the arguments in arguments
+        for each shard, and return their results in shard order.
+        """
+        for connection, shard_arguments in zip(self._connections, arguments):
+            connection.send((command, shard_arguments))
+        return self._replies()
+
+    def _by_owner(self, usernames):
+        """ (PartitionedTwitterverse, list of str) ->
+        tuple of (list of int, list of list of str)
+
+        Return the owner of each of usernames, and the usernames each shard
+        owns, in order.
+        """
+        owners = [owner(username, self.shards) for username in usernames]
+        groups = [[] for _ in range(self.shards)]
+        for username, shard in zip(usernames, owners):
+            groups[shard].append(username)
+        return owners, groups
+
+    def _gather(self, command, usernames, *arguments):
+        """ (PartitionedTwitterverse, str, list of str, object...) ->
+        list of object
+
+        Run command on the shards owning usernames and return its result for
+        each of usernames, in order.
+        """
+        owners, groups = self._by_owner(usernames)
+        results = self._call(command, [(group,) + arguments
+                                       for group in groups])
+        results = [iter(result) for result in results]
+        return [next(results[shard]) for shard in owners]
+
+    def __len__(self):
+        """ (PartitionedTwitterverse) -> int
+
+        Return the number of users with a profile.
+        """
+        return sum(self._call('size', [()] * self.shards))
+
+    def search(self, search):
+        """ (PartitionedTwitterverse, Search specification dictionary) ->
+        list of str
+
+        Return the results of search, as get_search_results does.
+        """
+        frontier = [search['username']]
+        for operation in search_operations(search):
+            if not frontier:
+                continue
+            if operation not in ('followers', 'following'):
+                raise ValueError('unknown search operation: {0!r}'
+                                 .format(operation))
+            seen = set()
+            reached = []
+            for username, users in zip(frontier, self._gather(
+                    'expand', frontier, operation)):
+                if users is None:
+                    raise KeyError(username)
+                for user in users:
+                    if user not in seen:
+                        seen.add(user)
+                        reached.append(user)
+            frontier = reached
+        return frontier
+
+    def filter(self, users, filterd):
+        """ (PartitionedTwitterverse, list of str, Filter specification
+        dictionary) -> list of str
+
+        Return the users that pass filterd, in order, as get_filter_results
+        does.
+        """
+        if users == [] or filterd == {}:
+            return users[:]
+        followed = None
+        if 'follower' in filterd:
+            following = self._gather('fields', [filterd['follower']],
+                                     ('following',))[0]
+            if following is None:
+                raise KeyError(filterd['follower'])
+            followed = set(following['following'])
+        owners, groups = self._by_owner(users)
+        replies = self._call('filter', [(group, filterd, followed)
+                                        for group in groups])
+        flags = [iter(keep) for keep in replies]
+        return [user for user, shard in zip(users, owners)
+                if next(flags[shard])]
+
+    def present(self, users, present):
+        """ (PartitionedTwitterverse, list of str, Presentation
+        specification dictionary) -> str
+
+        Return the presentation of users, as get_present_string does.
+        """
+        if present['format'] in COUNT_FORMATS:
+            return str(present_count(len(users), present))
+        sort_by = present['sort-by']
+        if sort_by == 'popularity':
+            counts = dict(zip(users, self._gather('follower_counts', users)))
+            key = lambda user: (-counts[user], user)
+        elif sort_by == 'username':
+            key = lambda user: user
+        elif sort_by == 'name':
+            names = {user: profile['name'] for user, profile in
+                     zip(users, self._gather('fields', users, ('name',)))
+                     if profile is not None}
+            key = lambda user: (names[user], user)
+        else:
+            key = None
+        limit = present_limit(present)
+        if key is None or len(users) < 2:
+            ordered = users[:limit]
+        elif limit is None:
+            ordered = sorted(users, key=key)
+        else:
+            ordered = heapq.nsmallest(limit, users, key=key)
+        profiles = {}
+        if present['format'] == 'long':
+            fields = self._gather('fields', ordered, ('name', 'location',
+                                                      'web', 'bio',
+                                                      'following'))
+            profiles = {user: profile for user, profile in zip(ordered, fields)
+                        if profile is not None}
+        # The users are already in order, so present them unsorted
+        return get_present_string(profiles, ordered,
+                                  {'sort-by': None,
+                                   'format': present['format']})
+
+    def run_query(self, query):
+        """ (PartitionedTwitterverse, Query dictionary) -> str
+
+        Return the presentation of the results of query, as run_query does.
+
+        >>> import os, tempfile
+        >>> from twitterverse_functions import process_data, run_query
+        >>> path = os.path.join(tempfile.mkdtemp(), 'data.txt')
+        >>> with open(path, 'w') as data_file:
+        ...     _ = data_file.write('a\\nAnn\\nOz\\n\\nENDBIO\\nb\\nc\\nEND\\n'
+        ...                         'b\\nBob\\n\\n\\nENDBIO\\na\\nEND\\n'
+        ...                         'c\\nCara\\nOz\\n\\nENDBIO\\nb\\nEND\\n')
+        >>> query = {'search': {'username': 'b', 'operations': ['followers']},\
+        'filter': {'location-includes': 'Oz'}, 'present': {'sort-by':\
+        'name', 'format': 'short'}}
+        >>> with PartitionedTwitterverse(path, shards=2) as twitterverse:
+        ...     twitterverse.run_query(query)
+        "['a', 'c']"
+        >>> run_query(process_data(open(path)), query)
+        "['a', 'c']"
+        >>> query['present'] = {'format': 'count'}
+        >>> with PartitionedTwitterverse(path, shards=2) as twitterverse:
+        ...     twitterverse.run_query(query)
+        '2'
+        >>> run_query(process_data(open(path)), query)
+        '2'
+        """
+        search = query['search']
+        present = query['present']
+        for operation in search['operations']:
+            if operation in SIMILARITY_OPERATIONS:
+                raise ValueError('{0!r} searches need the whole graph and '
+                                 'cannot run partitioned'.format(operation))
+        if present.get('sort-by') == 'influence':
+            raise ValueError('sorting by influence needs the whole graph '
+                             'and cannot run partitioned')
+        results = self.search(search)
+        results = self.filter(results, query['filter'])
+        return self.present(results, present)
+
+    def close(self):
+        """ (PartitionedTwitterverse) -> NoneType
+
+        Stop the worker processes.
+        """
+        for connection in self._connections:
+            try:
+                connection.send(('close', ()))
+            except OSError:
+                pass
+            connection.close()
+        for worker in self._workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+        self._connections = []
+        self._workers = []
+
+    def __enter__(self):
+        """ (PartitionedTwitterverse) -> PartitionedTwitterverse """
+        return self
+
+    def __exit__(self, *exc_info):
+        """ (PartitionedTwitterverse, object, object, object) -> NoneType """
+        self.close()
+
+
+def main(argv=None):
+    """ (list of str or NoneType) -> NoneType
+
+    Run a query file against a data file loaded into partitioned workers
+    and print its output.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('data', help='Twitterverse data file')
+    parser.add_argument('query', help='query file')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='number of worker processes (default: CPUs)')
+    args = parser.parse_args(argv)
+    with open(args.query) as query_file:
+        query = process_query(query_file)
+    with PartitionedTwitterverse(args.data, args.shards) as twitterverse:
+        print(twitterverse.run_query(query))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""
+Cost-based planning of Twitterverse queries.
+
+run_query always expands the whole search, then filters the results.  When
+the filter names a small set of users that can pass it (the followers of
+the user in "following", the users followed by the user in "follower", or
+the index candidates of the text filters, such as "bio-includes"), a plan
+can instead stop the search one hop early and keep only the candidates that
+the last hop would reach: a candidate is reached by "followers" if it
+follows someone in the frontier, and by "following" if someone in the
+frontier follows it.  If there are no candidates, a search of only
+"followers" steps is skipped; any other search is still walked, so that a
+"following" step from a user without a profile fails as in run_query.
+
+plan_query estimates the cost of both plans from degree statistics of the
+graph and picks the cheaper one.  QueryPlan.run returns exactly the output
+of run_query.  explain runs a query and describes its plan, with estimated
+and actual sizes.
+"""
+
+import weakref
+
+from twitterverse_functions import (COUNT_FORMATS, compile_filter,
+                                    get_present_string, run_query, sort_key)
+from twitterverse_similar import SIMILAR_COUNT, SIMILARITY_OPERATIONS
+
+# Share of users a substring filter is assumed to keep without an index
+SUBSTRING_SELECTIVITY = 0.1
+INDEXED_FILTERS = ('name-includes', 'location-includes', 'bio-includes',
+                   'bio-phrase')
+
+_cache = weakref.WeakKeyDictionary()
+
+
+class GraphStats:
+    """ Degree statistics of a TwitterGraph, for estimating search sizes. """
+
+    def __init__(self, graph):
+        """ (GraphStats, TwitterGraph) -> NoneType
+
+        Initialize the statistics of graph as it is now, from the degree
+        sums it keeps up to date as it is edited.
+        """
+        self.version = graph.version
+        self.users = len(graph.names)
+        (self.edges, following, followers,
+         out_squares, in_squares) = graph.degree_sums()
+        edges = max(1, self.edges)
+        # The mean degree, for an operation, of the users reached by the
+        # previous one.  Users reached along an edge are biased towards high
+        # degree in that edge's direction: a user reached by 'following' is
+        # one with many followers.
+        self.mean_degree = {
+            ('following', None): self.edges / max(1, following),
+            ('followers', None): self.edges / max(1, followers),
+            ('following', 'following'): self.edges / max(1, following),
+            ('followers', 'followers'): self.edges / max(1, followers),
+            ('followers', 'following'): in_squares / edges,
+            ('following', 'followers'): out_squares / edges}
+
+    def degree(self, operation, previous=None):
+        """ (GraphStats, str[, str]) -> float
+
+        Return the estimated degree, for operation, of a user reached by the
+        operation previous.
+        """
+        if operation in SIMILARITY_OPERATIONS:
+            return float(SIMILAR_COUNT)
+        return self.mean_degree.get((operation, previous), 0.0)
+
+    def expand(self, size, operation, previous=None):
+        """ (GraphStats, float, str[, str]) -> float
+
+        Return the estimated number of distinct users one operation away
+        from size users reached by the operation previous.
+        """
+        return min(self.users, size * self.degree(operation, previous))
+
+
+def graph_stats(graph):
+    """ (TwitterGraph) -> GraphStats
+
+    Return the statistics of graph, reusing them until its version changes.
+    Edits keep the graph's degree sums current, so a rebuild after an edit
+    does not scan the graph.
+    """
+    stats = _cache.get(graph)
+    if stats is None or stats.version != graph.version:
+        stats = _cache[graph] = GraphStats(graph)
+    return stats
+
+
+def _degree(graph, uid, operation):
+    """ (TwitterGraph, int, str) -> int
+
+    Return the number of users one operation away from user uid, or an
+    upper bound for a similarity search.
+    """
+    if operation in SIMILARITY_OPERATIONS:
+        return SIMILAR_COUNT
+    if operation == 'followers':
+        return len(graph.follower_ids(uid))
+    return len(graph.following_ids(uid))
+
+
+def _candidates(graph, filterd, index):
+    """ (TwitterGraph, Filter specification dictionary, Text index dictionary
+    or NoneType) -> tuple of (set of int or NoneType, list of str)
+
+    Return the IDs of a set of users containing every user that passes
+    filterd, or None if no filter narrows it, and the filters used.
+    """
+    sets = []
+    used = []
+    if 'following' in filterd:
+        uid = graph.user_id(filterd['following'])
+        sets.append(set() if uid < 0 else set(graph.follower_ids(uid)))
+        used.append('following')
+    if 'follower' in filterd:
+        uid = graph.ids[filterd['follower']]
+        sets.append(set(graph.following_ids(uid)))
+        used.append('follower')
+    for key in INDEXED_FILTERS:
+        if key in filterd and index is not None and key in index:
+            names = index[key].candidates(filterd[key])
+            if names is not None:
+                ids = graph.ids
+                sets.append({ids[name] for name in names if name in ids})
+                used.append(key)
+    if not sets:
+        return None, used
+    sets.sort(key=len)
+    return sets[0].intersection(*sets[1:]), used
+
+
+class QueryPlan:
+    """ The chosen evaluation order of a query, with its size estimates. """
+
+    def __init__(self, query, estimates, candidates=None, pushed=(),
+                 estimated_results=0.0):
+        """ (QueryPlan, Query dictionary, list of float[, set of int,
+        list of str, float]) -> NoneType
+
+        Initialize a plan for query whose search frontiers are estimated to
+        hold estimates users after each operation.  If candidates is given,
+        the filters in pushed narrow the last hop to those user IDs.
+        estimated_results is the estimated number of filtered results.
+        """
+        self.query = query
+        self.estimates = estimates
+        self.candidates = candidates
+        self.pushed = list(pushed)
+        self.estimated_results = estimated_results
+        self.actual = None
+        self.results = None
+
+    def skips_search(self):
+        """ (QueryPlan) -> bool
+
+        Return whether this plan skips the search: no candidate passes the
+        filters, and every operation is 'followers', which cannot fail.
+        """
+        return (self.candidates is not None and not self.candidates
+                and set(self.query['search']['operations']) == {'followers'})
+
+    def _last_hop(self, graph, frontier, operation):
+        """ (QueryPlan, TwitterGraph, list of int, str) -> list of int
+
+        Return, in ID order, the candidates one operation away from the IDs
+        in frontier.
+        """
+        if operation == 'following':
+            for uid in frontier:
+                if not graph.has_profile[uid]:
+                    raise KeyError(graph.names[uid])
+            step = graph.follower_ids
+        elif operation == 'followers':
+            step = graph.following_ids
+        else:
+            raise ValueError('unknown search operation: {0!r}'.format(operation))
+        frontier = set(frontier)
+        return [uid for uid in sorted(self.candidates)
+                if not frontier.isdisjoint(step(uid))]
+
+    def run(self, twitterverse, graph, index=None):
+        """ (QueryPlan, Twitterverse dictionary, TwitterGraph[, Text index
+        dictionary]) -> str
+
+        Return the output of this plan's query on twitterverse, recording
+        the actual frontier and result sizes.
+        """
+        search = self.query['search']
+        filterd = self.query['filter']
+        operations = search['operations']
+        if self.candidates is None:
+            trace = {}
+            output = run_query(twitterverse, self.query, graph, index, trace)
+            self.actual = trace.get('frontier_sizes', [])
+            self.results = trace['results']
+            return output
+
+        if (operations[0] == 'following'
+                and graph.user_id(search['username']) < 0):
+            raise KeyError(search['username'])
+        self.actual = []
+        reached = []
+        if not self.skips_search():
+            frontier = graph.search_ids(search['username'], operations[:-1],
+                                        self.actual)
+            if frontier:
+                reached = self._last_hop(graph, frontier, operations[-1])
+            self.actual.append(len(reached))
+        names = graph.names
+        results = [names[uid] for uid in reached]
+        if results:
+            keep = compile_filter(twitterverse, filterd, graph, index)
+            results = [name for name in results if keep(name)]
+        self.results = len(results)
+        return get_present_string(twitterverse, results, self.query['present'],
+                                  graph)
+
+    def explain(self):
+        """ (QueryPlan) -> str
+
+        Return a description of this plan, with the actual sizes if it has
+        been run.
+        """
+        def sizes(estimate, actual):
+            if actual is None:
+                return 'estimated {0:.0f}'.format(estimate)
+            return 'estimated {0:.0f}, actual {1}'.format(estimate, actual)
+
+        search = self.query['search']
+        operations = search['operations']
+        actual = self.actual or []
+        lines = ['search from {0!r}'.format(search['username'])]
+        if self.skips_search():
+            lines.append('  no user passes {0}: search skipped'
+                         .format(', '.join(self.pushed)))
+        for i, operation in enumerate(operations):
+            step = '  {0}. {1}'.format(i + 1, operation)
+            if self.candidates is not None and i == len(operations) - 1:
+                step += ', checking {0} candidates from {1}'.format(
+                    len(self.candidates), ', '.join(self.pushed))
+            if not self.skips_search():
+                lines.append('{0}: {1}'.format(step, sizes(
+                    self.estimates[i], actual[i] if i < len(actual) else None)))
+        if self.query['filter']:
+            lines.append('filter {0}: {1}'.format(', '.join(
+                '{0} {1}'.format(key, value)
+                for key, value in self.query['filter'].items()),
+                sizes(self.estimated_results, self.results)))
+        present = self.query['present']
+        lines.append('present {0}'.format(', '.join(
+            '{0} {1}'.format(key, value) for key, value in present.items())))
+        return '\n'.join(lines)
+
+
+def plan_query(twitterverse, query, graph, index=None):
+    """ (Twitterverse dictionary, Query dictionary, TwitterGraph[, Text index
+    dictionary]) -> QueryPlan
+
+    Return the cheaper of the plans for query: searching then filtering, or
+    checking the filter's candidates at the last hop of the search.
+    """
+    stats = graph_stats(graph)
+    search = query['search']
+    filterd = query['filter']
+    operations = search['operations']
+
+    uid = graph.user_id(search['username'])
+    estimates = []
+    start = size = 0.0 if uid < 0 else 1.0
+    for i, operation in enumerate(operations):
+        if i == 0 and uid >= 0:
+            size = float(_degree(graph, uid, operation))
+        else:
+            size = stats.expand(size, operation, operations[i - 1])
+        estimates.append(size)
+
+    selectivity = 1.0
+    for key, value in filterd.items():
+        if key == 'following':
+            selectivity *= graph.follower_count(value) / max(1, stats.users)
+        elif key == 'follower':
+            selectivity *= graph.following_count(value) / max(1, stats.users)
+        else:
+            candidates = None
+            if index is not None and key in index:
+                candidates = index[key].candidates(value)
+            if candidates is None:
+                selectivity *= SUBSTRING_SELECTIVITY
+            else:
+                selectivity *= len(candidates) / max(1, stats.users)
+    searched = estimates[-1] if operations else size
+    estimated_results = searched * selectivity
+
+    # The order of the results only matters when they are listed unsorted,
+    # a 'follower' filter on a user without a profile must fail as before,
+    # and a similarity search cannot be checked backwards from a candidate
+    present = query['present']
+    if (not operations or not filterd
+            or not set(operations).isdisjoint(SIMILARITY_OPERATIONS)
+            or (present['format'] not in COUNT_FORMATS
+                and sort_key(twitterverse, [], present['sort-by'],
+                             graph) is None)
+            or ('follower' in filterd and filterd['follower'] not in graph)):
+        return QueryPlan(query, estimates, estimated_results=estimated_results)
+    candidates, pushed = _candidates(graph, filterd, index)
+    if candidates is None:
+        return QueryPlan(query, estimates, estimated_results=estimated_results)
+
+    if len(operations) > 1:
+        before = estimates[-2]
+        expand_cost = before * stats.degree(operations[-1], operations[-2])
+    else:
+        before = start
+        expand_cost = estimates[0]
+    inverse = 'following' if operations[-1] == 'followers' else 'followers'
+    check_cost = before + sum(_degree(graph, candidate, inverse)
+                              for candidate in candidates)
+    if candidates and check_cost >= expand_cost:
+        return QueryPlan(query, estimates, estimated_results=estimated_results)
+    estimates[-1] = min(estimates[-1], float(len(candidates)))
+    return QueryPlan(query, estimates, candidates, pushed,
+                     min(estimated_results, len(candidates)))
+
+
+def run_planned(twitterverse, query, graph, index=None):
+    """ (Twitterverse dictionary, Query dictionary, TwitterGraph[, Text index
+    dictionary]) -> str
+
+    Return the output of query on twitterverse, as run_query does, using
+    the plan chosen by plan_query.
+
+    >>> from twitterverse_graph import build_graph
+    >>> a = {'a': {'web': '', 'name': '', 'following': ['g'], 'location':\
+    '', 'bio': ''}, 'b': {'web': '', 'name': '', 'following': [],\
+    'location': '', 'bio': ''}}
+    >>> query = {'search': {'username': 'a', 'operations': ['following',\
+    'following']}, 'filter': {'following': 'b'}, 'present': {'sort-by':\
+    'username', 'format': 'short'}}
+    >>> run_planned(a, query, build_graph(a))
+    Traceback (most recent call last):
+    ...
+    KeyError: 'g'
+    """
+    return plan_query(twitterverse, query, graph, index).run(twitterverse,
+                                                             graph, index)
+
+
+def explain(twitterverse, query, graph, index=None):
+    """ (Twitterverse dictionary, Query dictionary, TwitterGraph[, Text index
+    dictionary]) -> str
+
+    Run query on twitterverse and return a description of its plan, with
+    the estimated and actual size of each step.
+
+    >>> from twitterverse_graph import build_graph
+    >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+    'following': [], 'location': '', 'bio': ''},\
+    'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+    'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+    >>> query = {'search': {'username': 'katieH', 'operations': ['followers']},\
+    'filter': {'following': 'nobody'}, 'present': {'sort-by': 'username',\
+    'format': 'short'}}
+    >>> print(explain(a, query, build_graph(a)))
+    search from 'katieH'
+      no user passes following: search skipped
+    filter following nobody: estimated 0, actual 0
+    present sort-by username, format short
+    """
+    plan = plan_query(twitterverse, query, graph, index)
+    plan.run(twitterverse, graph, index)
+    return plan.explain()
@@ -0,0 +1,375 @@
+"""
+A resident query server that keeps a Twitterverse loaded between queries.
+
+The server speaks a small subset of HTTP/1.1 over TCP or a Unix socket:
+
+    POST /query    body is a query in the SEARCH/FILTER/PRESENT file format;
+                   the response body is its output
+    POST /explain  body is a query; the response body describes the plan
+                   it ran with (see twitterverse_planner)
+    POST /reload   body is empty or the path of a new dataset; the new
+                   dataset replaces the old one once it has loaded
+    GET /stats     the response body is a JSON object of server counters
+
+Queries are planned by twitterverse_planner and evaluated in a pool of
+worker processes, each holding the dataset (a snapshot is mapped, so the
+workers share its pages).  At most max_pending queries are submitted to the
+pool at once; further queries wait for a free slot, and once max_waiting are
+waiting new queries are refused with 503 so that clients back off.  A
+reload starts a new pool and swaps it in only after its workers have loaded
+the dataset; queries already running finish on the old pool.  If a worker
+dies, the pool can run nothing more, so the query that finds it broken
+fails with 500 and the pool is replaced as if by a reload.
+
+    python twitterverse_server.py data.txt --port 8000 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+
+from twitterverse_batch import dataset_graph, load_dataset
+from twitterverse_functions import process_query
+from twitterverse_planner import explain, run_planned
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+MAX_BODY = 1024 * 1024
+
+_worker = {}
+
+
+def _init_worker(data_path):
+    """ (str) -> NoneType
+
+    Load the dataset at data_path into this worker process.
+    """
+    _worker['twitterverse'] = load_dataset(data_path)
+    _worker['graph'] = dataset_graph(_worker['twitterverse'])
+
+
+def _loaded(_):
+    """ (object) -> int
+
+    Return the number of users this worker has loaded.
+    """
+    return len(_worker['twitterverse'])
+
+
+def answer_query(text):
+    """ (str) -> str
+
+    Return the output of the query text against this worker's dataset.
+    """
+    query = process_query(StringIO(text))
+    output = run_planned(_worker['twitterverse'], query, _worker['graph'])
+    return str(output)
+
+
+def explain_query(text):
+    """ (str) -> str
+
+    Return the plan, with estimated and actual sizes, of the query text
+    against this worker's dataset.
+    """
+    query = process_query(StringIO(text))
+    return explain(_worker['twitterverse'], query, _worker['graph']) + '\n'
+
+
+class QueryServer:
+    """ Serves queries against a dataset held by a pool of workers. """
+
+    def __init__(self, data_path, workers=None, max_pending=None,
+                 max_waiting=1000):
+        """ (QueryServer, str[, int, int, int]) -> NoneType
+
+        Initialize a server for the dataset at data_path with workers
+        worker processes (one per CPU by default), at most max_pending
+        queries in the pool (four per worker by default) and at most
+        max_waiting queries waiting for the pool.
+        """
+        self.data_path = data_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        self.max_waiting = max_waiting
+        self.pool = None
+        self.version = 0
+        self.counters = {'answered': 0, 'failed': 0, 'rejected': 0,
+                         'reloads': 0, 'restarts': 0}
+        self._waiting = 0
+        self._running = 0
+        self._slots = None
+        self._reload_lock = None
+
+    async def _start_pool(self, data_path):
+        """ (QueryServer, str) -> ProcessPoolExecutor
+
+        Return a new pool whose workers have all loaded data_path.
+        """
+        # Forking a process that already runs pool threads can deadlock the
+        # child, so reloads start their workers with spawn
+        pool = ProcessPoolExecutor(self.workers,
+                                   multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(data_path,))
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*[loop.run_in_executor(pool, _loaded, None)
+                                   for _ in range(self.workers)])
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        return pool
+
+    async def start(self):
+        """ (QueryServer) -> NoneType
+
+        Load the dataset into the worker pool.
+        """
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._reload_lock = asyncio.Lock()
+        self.pool = await self._start_pool(self.data_path)
+
+    async def reload(self, data_path=None):
+        """ (QueryServer[, str]) -> int
+
+        Replace the dataset with the one at data_path (by default, the
+        current path again) and return the new dataset version.  Queries
+        keep using the old dataset until the new one is fully loaded.
+        """
+        async with self._reload_lock:
+            return await self._replace_pool(data_path or self.data_path)
+
+    async def _replace_pool(self, data_path):
+        """ (QueryServer, str) -> int
+
+        Swap in a new pool for the dataset at data_path once it has loaded,
+        and return the new dataset version.  The caller holds the reload
+        lock.
+        """
+        pool = await self._start_pool(data_path)
+        old, self.pool = self.pool, pool
+        self.data_path = data_path
+        self.version += 1
+        self.counters['reloads'] += 1
+        old.shutdown(wait=False)
+        return self.version
+
+    async def _restart(self, broken):
+        """ (QueryServer, ProcessPoolExecutor) -> NoneType
+
+        Replace the pool broken, unless another query has already replaced
+        it.  If the dataset cannot be loaded, the next query tries again.
+        """
+        async with self._reload_lock:
+            if self.pool is not broken:
+                return
+            try:
+                await self._replace_pool(self.data_path)
+            except Exception:
+                return
+            self.counters['restarts'] += 1
+
+    async def query(self, text, function=answer_query):
+        """ (QueryServer, str[, function]) -> tuple of (int, str)
+
+        Return the HTTP status and body answering the query text with
+        function, which runs in a worker.  If the pool is broken, replace it
+        before answering.
+        """
+        if self._slots.locked() and self._waiting >= self.max_waiting:
+            self.counters['rejected'] += 1
+            return 503, 'too many queries waiting, retry later\n'
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        pool = self.pool
+        try:
+            loop = asyncio.get_running_loop()
+            output = await loop.run_in_executor(pool, function, text)
+        except (ValueError, IndexError, KeyError) as error:
+            self.counters['failed'] += 1
+            return 400, 'bad query: {0!r}\n'.format(error)
+        except BrokenProcessPool as error:
+            self.counters['failed'] += 1
+            await self._restart(pool)
+            return 500, 'query failed: {0!r}\n'.format(error)
+        except Exception as error:
+            self.counters['failed'] += 1
+            return 500, 'query failed: {0!r}\n'.format(error)
+        finally:
+            self._running -= 1
+            self._slots.release()
+        self.counters['answered'] += 1
+        return 200, output
+
+    def stats(self):
+        """ (QueryServer) -> dict of {str: object}
+
+        Return the server's counters, dataset and load.
+        """
+        stats = dict(self.counters)
+        stats.update({'data_path': self.data_path, 'version': self.version,
+                      'workers': self.workers, 'waiting': self._waiting,
+                      'running': self._running})
+        return stats
+
+    async def _respond(self, method, path, body):
+        """ (QueryServer, str, str, str) -> tuple of (int, str)
+
+        Return the HTTP status and body answering a request.
+
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'data.txt')
+        >>> with open(path, 'w') as data_file:
+        ...     _ = data_file.write('a\\nAnn\\n\\n\\nENDBIO\\nb\\nEND\\n'
+        ...                         'b\\nBob\\n\\n\\nENDBIO\\na\\nEND\\n')
+        >>> query = ('SEARCH\\na\\nfollowing\\nFILTER\\nPRESENT\\n'
+        ...          'sort-by username\\nformat short\\n')
+        >>> async def session(server):
+        ...     await server.start()
+        ...     try:
+        ...         answers = [await server._respond('POST', '/query', query),
+        ...                    await server._respond('POST', '/query', 'SEARCH\\n')]
+        ...         answers += await asyncio.gather(
+        ...             server._respond('POST', '/query', query),
+        ...             server._respond('POST', '/query', query))
+        ...         answers.append(await server._respond('POST', '/reload', ''))
+        ...         for process in list(server.pool._processes.values()):
+        ...             process.kill()
+        ...         answers.append((await server._respond('POST', '/query',
+        ...                                               query))[0])
+        ...         answers.append(await server._respond('POST', '/query', query))
+        ...         return answers, server.counters
+        ...     finally:
+        ...         server.pool.shutdown()
+        >>> answers, counters = asyncio.run(session(QueryServer(path, 1, 1, 0)))
+        >>> for answer in answers:
+        ...     print(answer)
+        (200, "['b']")
+        (400, "bad query: IndexError('list index out of range')\\n")
+        (200, "['b']")
+        (503, 'too many queries waiting, retry later\\n')
+        (200, '{"version": 1}\\n')
+        500
+        (200, "['b']")
+        >>> counters['restarts'], counters['rejected']
+        (1, 1)
+        """
+        if path == '/query':
+            if method != 'POST':
+                return 405, 'use POST\n'
+            return await self.query(body)
+        if path == '/explain':
+            if method != 'POST':
+                return 405, 'use POST\n'
+            return await self.query(body, explain_query)
+        if path == '/reload':
+            if method != 'POST':
+                return 405, 'use POST\n'
+            try:
+                version = await self.reload(body.strip() or None)
+            except Exception as error:
+                return 500, 'reload failed: {0!r}\n'.format(error)
+            return 200, json.dumps({'version': version}) + '\n'
+        if path == '/stats':
+            return 200, json.dumps(self.stats(), sort_keys=True) + '\n'
+        return 404, 'no such endpoint\n'
+
+    async def handle(self, reader, writer):
+        """ (QueryServer, StreamReader, StreamWriter) -> NoneType
+
+        Answer the HTTP requests on one client connection.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path = request_line.decode('latin-1').split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, body = 413, 'query too large\n'
+                else:
+                    data = await reader.readexactly(length)
+                    status, body = await self._respond(method, path,
+                                                       data.decode('utf-8'))
+                close = (headers.get('connection', '').lower() == 'close'
+                         or status == 413)
+                payload = body.encode('utf-8')
+                writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: text/plain; '
+                             'charset=utf-8\r\nContent-Length: {2}\r\n{3}\r\n'
+                             .format(status, REASONS[status], len(payload),
+                                     'Connection: close\r\n' if close else '')
+                             .encode('latin-1') + payload)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000, unix_path=None):
+        """ (QueryServer[, str, int, str]) -> NoneType
+
+        Load the dataset, then serve on host and port, or on the Unix
+        socket unix_path if given, until cancelled.
+        """
+        await self.start()
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    """ ([list of str]) -> NoneType
+
+    Serve the dataset named by the command line arguments argv.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('data_path', help='data file or snapshot to serve')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='serve on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--max-pending', type=int,
+                        help='queries in the pool at once (default: 4 per '
+                             'worker)')
+    parser.add_argument('--max-waiting', type=int, default=1000,
+                        help='queries waiting before new ones are refused')
+    args = parser.parse_args(argv)
+    server = QueryServer(args.data_path, args.workers, args.max_pending,
+                         args.max_waiting)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
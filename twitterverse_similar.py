@@ -0,0 +1,267 @@
+"""
+Similar accounts and follow recommendations for the users of a Twitterverse.
+
+Two users are similar when they follow the same accounts: their similarity
+is the Jaccard index of their following sets, the number of accounts both
+follow over the number either follows.  Two search operations use it:
+    - "similar" reaches the SIMILAR_COUNT users most similar to each user
+    - "recommend" reaches the SIMILAR_COUNT accounts that a user does not
+      follow yet but that are followed by the users most similar to them,
+      scored by the sum of those users' similarities
+
+Comparing a user with every other is too slow on a large graph, so a
+SimilarityIndex keeps a MinHash signature of every following set: for each
+of BANDS * ROWS hash functions, the least hash of an account in the set.
+Two sets agree on a hash function with probability equal to their Jaccard
+index.  The signature is cut into BANDS bands of ROWS values, and users
+whose signatures agree on a whole band share a bucket of that band, so a
+pair with similarity s becomes a candidate with probability
+1 - (1 - s ** ROWS) ** BANDS (about 0.5 for s = 0.2 and 0.99 for s = 0.5).
+The CANDIDATES candidates sharing the most buckets with a user are ranked by
+their exact Jaccard index.  Users who follow no one are similar to no one.
+
+NumPy is used to build the index if it is installed; otherwise the same
+index is built in pure Python, which is much slower on large graphs.
+similarity_index caches the index of each graph until its version changes.
+"""
+
+import weakref
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from twitterverse_influence import edge_arrays
+
+SIMILARITY_OPERATIONS = ('similar', 'recommend')
+SIMILAR_COUNT = 10
+CANDIDATES = 100
+BANDS = 16
+ROWS = 2
+
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK = (1 << 64) - 1
+
+_cache = weakref.WeakKeyDictionary()
+
+
+def _mix(value):
+    """ (int) -> int
+
+    Return the splitmix64 finalizer of the 64-bit value.
+    """
+    value = (value ^ value >> 30) * 0xBF58476D1CE4E5B9 & _MASK
+    value = (value ^ value >> 27) * 0x94D049BB133111EB & _MASK
+    return value ^ value >> 31
+
+
+def _node_hashes(n, function):
+    """ (int, int) -> list of int
+
+    Return the 32-bit hash, for hash function number function, of each of
+    the user IDs 0 to n - 1.
+    """
+    offset = (function + 1) * _GOLDEN
+    return [_mix(uid + offset & _MASK) >> 32 for uid in range(n)]
+
+
+def _node_hashes_numpy(n, function):
+    """ (int, int) -> ndarray
+
+    Return _node_hashes(n, function) as a NumPy array.
+    """
+    with numpy.errstate(over='ignore'):
+        z = (numpy.arange(n, dtype=numpy.uint64)
+             + numpy.uint64((function + 1) * _GOLDEN & _MASK))
+        z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> numpy.uint64(31))
+    return (z >> numpy.uint64(32)).astype(numpy.uint32)
+
+
+def _band_key(values):
+    """ (list of int) -> int
+
+    Return the 32-bit bucket key of a band of 32-bit MinHash values, made
+    of the high 16 bits of each value.  values may also be NumPy arrays of
+    the values of every user.
+    """
+    key = 0
+    for value in values:
+        key = (key << 16 | value >> 16) & 0xFFFFFFFF
+    return key
+
+
+class SimilarityIndex:
+    """ MinHash buckets of the following sets of a graph's users. """
+
+    def __init__(self, graph):
+        """ (SimilarityIndex, TwitterGraph) -> NoneType
+
+        Initialize an index of the following sets of the users of graph.
+        The graph must not change while the index is in use.
+        """
+        self.graph = graph
+        self.version = graph.version
+        if numpy is not None:
+            self._build_numpy()
+        else:
+            self._build_python()
+
+    def _build_python(self):
+        """ (SimilarityIndex) -> NoneType
+
+        Build the band keys and buckets in pure Python.
+        """
+        graph = self.graph
+        n = len(graph.names)
+        following = [graph.following_ids(uid) for uid in range(n)]
+        self.keys = []
+        self._buckets = []
+        for band in range(BANDS):
+            rows = []
+            for function in range(band * ROWS, (band + 1) * ROWS):
+                hashes = _node_hashes(n, function)
+                hash_of = hashes.__getitem__
+                rows.append([min(map(hash_of, targets)) if targets else 0
+                             for targets in following])
+            keys = [_band_key(values) for values in zip(*rows)]
+            buckets = {}
+            for uid in range(n):
+                if following[uid]:
+                    buckets.setdefault(keys[uid], []).append(uid)
+            self.keys.append(keys)
+            self._buckets.append(buckets)
+
+    def _build_numpy(self):
+        """ (SimilarityIndex) -> NoneType
+
+        Build the band keys and buckets with NumPy, one pass over the
+        following arrays per hash function.
+        """
+        graph = self.graph
+        n = len(graph.names)
+        sources, targets = edge_arrays(graph)
+        if graph.edited_following():
+            order = numpy.argsort(sources, kind='stable')
+            sources, targets = sources[order], targets[order]
+        degree = numpy.bincount(sources, minlength=n)
+        starts = numpy.zeros(n, dtype=numpy.int64)
+        numpy.cumsum(degree[:-1], out=starts[1:])
+        members = numpy.flatnonzero(degree)
+        starts = starts[members]
+        self.keys = numpy.zeros((BANDS, n), dtype=numpy.uint32)
+        self._sorted = []
+        self._order = []
+        for band in range(BANDS):
+            rows = []
+            for function in range(band * ROWS, (band + 1) * ROWS):
+                hashes = _node_hashes_numpy(n, function)[targets]
+                rows.append(numpy.minimum.reduceat(hashes, starts)
+                            if len(hashes) else hashes)
+            self.keys[band, members] = _band_key(rows)
+            order = members[numpy.argsort(self.keys[band, members],
+                                          kind='stable')]
+            self._order.append(order)
+            self._sorted.append(self.keys[band, order])
+
+    def _bucket(self, band, uid):
+        """ (SimilarityIndex, int, int) -> sequence of int
+
+        Return the IDs of the users sharing uid's bucket of band.
+        """
+        key = self.keys[band][uid]
+        if numpy is None:
+            return self._buckets[band].get(key, [])
+        keys = self._sorted[band]
+        return self._order[band][numpy.searchsorted(keys, key, 'left'):
+                                 numpy.searchsorted(keys, key, 'right')]
+
+    def _candidates(self, uid):
+        """ (SimilarityIndex, int) -> list of int
+
+        Return the IDs of at most CANDIDATES other users sharing the most
+        buckets with uid, ties broken by ID.
+        """
+        buckets = [self._bucket(band, uid) for band in range(BANDS)]
+        if numpy is None:
+            shared = Counter(other for bucket in buckets for other in bucket
+                             if other != uid)
+            return sorted(shared, key=lambda other: (-shared[other],
+                                                     other))[:CANDIDATES]
+        found = numpy.concatenate(buckets)
+        others, counts = numpy.unique(found[found != uid], return_counts=True)
+        return others[numpy.lexsort((others, -counts))[:CANDIDATES]].tolist()
+
+    def ranked(self, uid):
+        """ (SimilarityIndex, int) -> list of tuple of (float, int)
+
+        Return the similarity and ID of the candidates similar to user uid,
+        most similar first, ties broken by username.
+        """
+        graph = self.graph
+        following = set(graph.following_ids(uid))
+        if not following:
+            return []
+        names = graph.names
+        ranked = []
+        for other in self._candidates(uid):
+            theirs = set(graph.following_ids(other))
+            both = len(following & theirs)
+            if both:
+                ranked.append((both / (len(following) + len(theirs) - both),
+                               other))
+        ranked.sort(key=lambda pair: (-pair[0], names[pair[1]]))
+        return ranked
+
+    def similar_ids(self, uid, count=SIMILAR_COUNT):
+        """ (SimilarityIndex, int[, int]) -> list of int
+
+        Return the IDs of the count users most similar to user uid, most
+        similar first.
+        """
+        return [other for similarity, other in self.ranked(uid)[:count]]
+
+    def recommend_ids(self, uid, count=SIMILAR_COUNT):
+        """ (SimilarityIndex, int[, int]) -> list of int
+
+        Return the IDs of the count accounts that user uid does not follow
+        with the greatest total similarity of the similar users following
+        them, best first, ties broken by username.
+        """
+        graph = self.graph
+        following = set(graph.following_ids(uid))
+        scores = {}
+        for similarity, other in self.ranked(uid)[:SIMILAR_COUNT]:
+            for target in set(graph.following_ids(other)):
+                if target != uid and target not in following:
+                    scores[target] = scores.get(target, 0.0) + similarity
+        names = graph.names
+        return sorted(scores, key=lambda target: (-scores[target],
+                                                  names[target]))[:count]
+
+
+def similarity_index(graph):
+    """ (TwitterGraph) -> SimilarityIndex
+
+    Return the SimilarityIndex of graph, reusing it until its version
+    changes.
+
+    >>> from twitterverse_graph import build_graph
+    >>> graph = build_graph({\
+    'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['x', 'y', 'z']}, \
+    'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['x', 'y', 'z', 'w']}, \
+    'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['x', 'y']}, \
+    'd':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['q']}})
+    >>> index = similarity_index(graph)
+    >>> [(round(score, 2), graph.names[uid]) for score, uid in index.ranked(0)]
+    [(0.75, 'b'), (0.67, 'c')]
+    >>> [graph.names[uid] for uid in index.recommend_ids(2)]
+    ['z', 'w']
+    """
+    index = _cache.get(graph)
+    if index is None or index.version != graph.version:
+        index = _cache[graph] = SimilarityIndex(graph)
+    return index
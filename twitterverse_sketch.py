@@ -0,0 +1,287 @@
+"""
+HyperLogLog estimates of how many users a search reaches.
+
+For a sequence of search operations, ReachSketches keeps a table holding a
+HyperLogLog sketch of every user's reach: the set of users a search from
+that user with those operations returns.  A table is built from the table
+of the operations after the first by merging, for each user, the sketches
+of the users one operation away, so each hop costs one pass over the edges
+and every later search with those operations, from any user, is answered
+from a single sketch in microseconds.  Tables are built when first needed
+and kept until the graph changes, evicting the least recently used first
+once they take more than a byte budget.  The default budget holds the
+TABLE_HOPS tables a search of that many operations needs, and at least
+MAX_TABLE_BYTES; the tables of the search being answered are always kept.
+
+An estimate has a relative standard error of about 1.04 / sqrt(2 **
+precision), 6.5% at the default precision, and a table takes 2 ** precision
+bytes per user.  Users without a profile follow no one here, where a search
+would fail on them.  NumPy is required to build sketches; without it, and
+for similarity searches, estimate_reach counts the reach exactly.
+"""
+
+import math
+import weakref
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from twitterverse_influence import edge_arrays
+
+PRECISION = 8
+CHUNK_BYTES = 64 * 1024 * 1024
+MAX_TABLE_BYTES = 128 * 1024 * 1024
+TABLE_HOPS = 3
+MAX_PASSES = 64
+EDGE_OPERATIONS = {'followers', 'following'}
+
+_cache = weakref.WeakKeyDictionary()
+
+
+def _hashes(n):
+    """ (int) -> ndarray
+
+    Return well-mixed 64-bit hashes of the user IDs 0 to n - 1 (the
+    splitmix64 finalizer).
+    """
+    with numpy.errstate(over='ignore'):
+        z = (numpy.arange(n, dtype=numpy.uint64)
+             + numpy.uint64(0x9E3779B97F4A7C15))
+        z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+        return z ^ (z >> numpy.uint64(31))
+
+
+def _bit_length(values):
+    """ (ndarray) -> ndarray
+
+    Return the number of significant bits of each 64-bit value.
+    """
+    high = (values >> numpy.uint64(32)).astype(numpy.float64)
+    low = (values & numpy.uint64(0xFFFFFFFF)).astype(numpy.float64)
+    return numpy.where(high > 0, 32 + numpy.frexp(high)[1],
+                       numpy.frexp(low)[1])
+
+
+def estimate(registers):
+    """ (ndarray) -> float
+
+    Return the HyperLogLog estimate of the number of distinct users in the
+    sketch registers, using linear counting for small sets.
+    """
+    m = len(registers)
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / numpy.ldexp(1.0, -registers.astype(numpy.int32)).sum()
+    zeros = m - numpy.count_nonzero(registers)
+    if raw <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return raw
+
+
+class ReachSketches:
+    """ HyperLogLog sketches of every user's search reach in a graph. """
+
+    def __init__(self, graph, precision=PRECISION, max_bytes=None):
+        """ (ReachSketches, TwitterGraph[, int, int]) -> NoneType
+
+        Initialize sketches over graph with 2 ** precision registers each,
+        keeping at most about max_bytes of tables besides those of the
+        search being answered (by default, TABLE_HOPS tables and at least
+        MAX_TABLE_BYTES).  The graph must not change while the sketches are
+        in use.
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be from 4 to 16')
+        self.graph = graph
+        self.version = graph.version
+        self.registers = 1 << precision
+        hashes = _hashes(len(graph.names))
+        remainder = 64 - precision
+        self._register = (hashes >> numpy.uint64(remainder)).astype(numpy.intp)
+        rest = hashes & numpy.uint64((1 << remainder) - 1)
+        self._rank = (remainder + 1 - _bit_length(rest)).astype(numpy.uint8)
+        self._adjacency = {}
+        self._tables = OrderedDict()
+        if max_bytes is None:
+            max_bytes = max(MAX_TABLE_BYTES,
+                            TABLE_HOPS * len(graph.names) * self.registers)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+
+    def _neighbours(self, operation):
+        """ (ReachSketches, str) -> tuple of (ndarray, ndarray)
+
+        Return CSR offsets and neighbour IDs of every user for operation.
+        """
+        if operation in self._adjacency:
+            return self._adjacency[operation]
+        graph = self.graph
+        if operation not in ('followers', 'following'):
+            raise ValueError('unknown search operation: {0!r}'.format(operation))
+        if not graph.edited_following():
+            if operation == 'following':
+                offsets, neighbours = graph.fwd_offsets, graph.fwd_targets
+            else:
+                offsets, neighbours = graph.rev_offsets, graph.rev_sources
+            offsets = numpy.frombuffer(offsets, dtype=numpy.int64)
+            neighbours = numpy.frombuffer(neighbours, dtype=numpy.int32)
+        else:
+            sources, targets = edge_arrays(graph)
+            if operation == 'followers':
+                sources, targets = targets, sources
+            order = numpy.argsort(sources, kind='stable')
+            neighbours = targets[order]
+            offsets = numpy.zeros(len(graph.names) + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(sources, minlength=len(graph.names)),
+                         out=offsets[1:])
+        self._adjacency[operation] = (offsets, neighbours)
+        return offsets, neighbours
+
+    def _first_hop(self, offsets, neighbours):
+        """ (ReachSketches, ndarray, ndarray) -> ndarray
+
+        Return the sketch of each user's neighbours.
+        """
+        n = len(self.graph.names)
+        m = self.registers
+        table = numpy.zeros(n * m, dtype=numpy.uint8)
+        rows = numpy.repeat(numpy.arange(len(offsets) - 1, dtype=numpy.intp),
+                            numpy.diff(offsets))
+        numpy.maximum.at(table, rows * m + self._register[neighbours],
+                         self._rank[neighbours])
+        return table.reshape(n, m)
+
+    def _merge(self, offsets, neighbours, rest):
+        """ (ReachSketches, ndarray, ndarray, ndarray) -> ndarray
+
+        Return, for each user, the union of the sketches in rest of the
+        users one hop away.
+        """
+        m = self.registers
+        table = numpy.zeros((len(self.graph.names), m), dtype=numpy.uint8)
+        degree = numpy.diff(offsets)
+        limit = max(1, CHUNK_BYTES // m)
+        # Users with many neighbours are merged one at a time
+        for row in numpy.flatnonzero(degree > MAX_PASSES):
+            ids = neighbours[offsets[row]:offsets[row + 1]]
+            for k in range(0, len(ids), limit):
+                numpy.maximum(table[row], rest[ids[k:k + limit]].max(axis=0),
+                              out=table[row])
+        # The rest are merged one neighbour position at a time, in order of
+        # decreasing degree so that the users with a kth neighbour come first
+        rows = numpy.flatnonzero((degree > 0) & (degree <= MAX_PASSES))
+        rows = rows[numpy.argsort(-degree[rows], kind='stable')]
+        for first in range(0, len(rows), limit):
+            block = rows[first:first + limit]
+            starts = offsets[block]
+            descending = -degree[block]
+            merged = rest[neighbours[starts]]
+            for k in range(1, -descending[0]):
+                count = numpy.searchsorted(descending, -k)
+                numpy.maximum(merged[:count],
+                              rest[neighbours[starts[:count] + k]],
+                              out=merged[:count])
+            table[block] = merged
+        return table
+
+    def table(self, operations):
+        """ (ReachSketches, tuple of str) -> ndarray
+
+        Return the sketch of every user's reach with operations, indexed by
+        user ID, building it and the tables it depends on if needed.  Then
+        evict the least recently used tables, other than those operations
+        needs, until the rest fit in max_bytes.
+
+        >>> from twitterverse_graph import build_graph
+        >>> graph = build_graph({\
+        'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b']}, \
+        'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['a']}})
+        >>> sketches = ReachSketches(graph, 4, max_bytes=64)
+        >>> sketches.table(('followers', 'followers', 'following')).shape
+        (2, 16)
+        >>> sketches.bytes, sketches.evictions
+        (96, 0)
+        >>> _ = sketches.table(('following',))
+        >>> list(sketches._tables), sketches.bytes, sketches.evictions
+        ([('followers', 'followers', 'following'), ('following',)], 64, 1)
+        """
+        table = self._build(operations)
+        needed = {operations[k:] for k in range(len(operations))}
+        for cached in list(self._tables):
+            if self.bytes <= self.max_bytes:
+                break
+            if cached not in needed:
+                self.bytes -= self._tables.pop(cached).nbytes
+                self.evictions += 1
+        return table
+
+    def _build(self, operations):
+        """ (ReachSketches, tuple of str) -> ndarray
+
+        Return the table of operations, building and keeping it and the
+        tables it depends on if needed.
+        """
+        table = self._tables.get(operations)
+        if table is not None:
+            self._tables.move_to_end(operations)
+            return table
+        offsets, neighbours = self._neighbours(operations[0])
+        if len(operations) == 1:
+            table = self._first_hop(offsets, neighbours)
+        else:
+            table = self._merge(offsets, neighbours,
+                                self._build(operations[1:]))
+        self._tables[operations] = table
+        self.bytes += table.nbytes
+        return table
+
+    def estimate(self, username, operations):
+        """ (ReachSketches, str, list of str) -> int
+
+        Return an estimate of len(graph.search(username, operations)).
+        """
+        uid = self.graph.ids.get(username)
+        if uid is None:
+            if operations[:1] == ['following']:
+                raise KeyError(username)
+            return 0
+        if not operations:
+            return 1
+        registers = self.table(tuple(operations))[uid]
+        return min(round(estimate(registers)), len(self.graph.names))
+
+
+def reach_sketches(graph):
+    """ (TwitterGraph) -> ReachSketches
+
+    Return the ReachSketches of graph, reusing them until its version
+    changes.
+    """
+    sketches = _cache.get(graph)
+    if sketches is None or sketches.version != graph.version:
+        sketches = _cache[graph] = ReachSketches(graph)
+    return sketches
+
+
+def estimate_reach(graph, username, operations):
+    """ (TwitterGraph, str, list of str) -> int
+
+    Return an estimate of how many users graph.search(username, operations)
+    returns, or the exact number if NumPy is not installed or operations
+    include a similarity search.
+
+    >>> from twitterverse_graph import build_graph
+    >>> graph = build_graph({\
+    'a':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['b', 'c']}, \
+    'b':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['c']}, \
+    'c':{'name':'', 'location':'', 'web':'', 'bio':'', 'following':['a']}})
+    >>> estimate_reach(graph, 'c', ['followers', 'followers'])
+    2
+    """
+    if numpy is None or not set(operations) <= EDGE_OPERATIONS:
+        return len(graph.reach_ids(username, operations))
+    return reach_sketches(graph).estimate(username, operations)
@@ -0,0 +1,326 @@
+"""
+Binary snapshots of a Twitterverse dictionary.
+
+write_snapshot stores a parsed Twitterverse once; load_snapshot maps the file
+into memory read-only, so start-up does no parsing and several processes that
+load the same snapshot share its pages.  The loaded SnapshotView is a
+read-only Twitterverse dictionary whose profile fields are decoded on access.
+
+File layout (native byte order, every section aligned to 8 bytes):
+    - header: magic, byte order mark and the counts in HEADER
+    - section directory: an (offset, length) pair for each of SECTIONS
+    - name_offsets / name_heap: the interned usernames, profiles first
+    - field_offsets / text_heap: name, location, web and bio of each profile
+    - fwd_offsets / fwd_targets, rev_offsets / rev_sources: the CSR
+      adjacency of twitterverse_graph.TwitterGraph
+    - id_table: open-addressing hash table from username to user ID
+"""
+
+import mmap
+import struct
+import zlib
+from array import array
+from collections.abc import Mapping
+
+from twitterverse_graph import TwitterGraph, build_graph
+
+MAGIC = b'TWVSNAP1'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('=8sIqqq')
+SECTIONS = ('name_offsets', 'name_heap', 'field_offsets', 'text_heap',
+            'fwd_offsets', 'fwd_targets', 'rev_offsets', 'rev_sources',
+            'id_table')
+DIRECTORY = struct.Struct('=' + 'qq' * len(SECTIONS))
+FIELDS = ('name', 'location', 'web', 'bio')
+FIELD_INDEX = {field: k for k, field in enumerate(FIELDS)}
+ARRAY_TYPES = {'name_offsets': 'q', 'field_offsets': 'q', 'fwd_offsets': 'q',
+               'fwd_targets': 'i', 'rev_offsets': 'q', 'rev_sources': 'i',
+               'id_table': 'i'}
+
+
+class SnapshotError(ValueError):
+    """ Raised when a file is not a snapshot this module can read. """
+
+
+def _heap(strings):
+    """ (iterable of str) -> tuple of (array, bytes)
+
+    Return the UTF-8 offsets and concatenated bytes of strings.
+    """
+    offsets = array('q', [0])
+    chunks = []
+    size = 0
+    for string in strings:
+        data = string.encode('utf-8')
+        chunks.append(data)
+        size += len(data)
+        offsets.append(size)
+    return offsets, b''.join(chunks)
+
+
+def _table_size(count):
+    """ (int) -> int
+
+    Return the smallest power of two that is at least twice count.
+    """
+    size = 1
+    while size < 2 * count:
+        size *= 2
+    return size
+
+
+def write_snapshot(twitterverse, path, graph=None):
+    """ (Twitterverse dictionary, str[, TwitterGraph]) -> NoneType
+
+    Write twitterverse to the snapshot file at path.  graph, if given, is
+    an unedited build_graph(twitterverse), reused instead of rebuilt.
+    """
+    if graph is None:
+        graph = build_graph(twitterverse)
+    names = graph.names
+    name_offsets, name_heap = _heap(names)
+    field_offsets, text_heap = _heap(
+        twitterverse[username][field]
+        for username in twitterverse for field in FIELDS)
+
+    id_table = array('i', [-1]) * _table_size(len(names))
+    mask = len(id_table) - 1
+    for uid in range(len(names)):
+        data = name_heap[name_offsets[uid]:name_offsets[uid + 1]]
+        slot = zlib.crc32(data) & mask
+        while id_table[slot] != -1:
+            slot = (slot + 1) & mask
+        id_table[slot] = uid
+
+    sections = {'name_offsets': name_offsets, 'name_heap': name_heap,
+                'field_offsets': field_offsets, 'text_heap': text_heap,
+                'fwd_offsets': graph.fwd_offsets,
+                'fwd_targets': graph.fwd_targets,
+                'rev_offsets': graph.rev_offsets,
+                'rev_sources': graph.rev_sources, 'id_table': id_table}
+    position = HEADER.size + DIRECTORY.size
+    directory = []
+    payload = []
+    for section in SECTIONS:
+        data = bytes(sections[section])
+        padding = -position % 8
+        position += padding
+        directory.extend([position, len(data)])
+        payload.extend([b'\0' * padding, data])
+        position += len(data)
+    with open(path, 'wb') as snapshot:
+        snapshot.write(HEADER.pack(MAGIC, BYTE_ORDER_MARK, len(names),
+                                   len(twitterverse), len(graph.fwd_targets)))
+        snapshot.write(DIRECTORY.pack(*directory))
+        for data in payload:
+            snapshot.write(data)
+
+
+class _Usernames:
+    """ The username table of a snapshot, indexed by user ID. """
+
+    def __init__(self, view):
+        """ (_Usernames, SnapshotView) -> NoneType """
+        self._offsets = view._name_offsets
+        self._heap = view._name_heap
+
+    def __len__(self):
+        """ (_Usernames) -> int """
+        return len(self._offsets) - 1
+
+    def __getitem__(self, uid):
+        """ (_Usernames, int) -> str """
+        return str(self._heap[self._offsets[uid]:self._offsets[uid + 1]],
+                   'utf-8')
+
+
+class _UserIds:
+    """ The username to user ID hash table of a snapshot. """
+
+    def __init__(self, view):
+        """ (_UserIds, SnapshotView) -> NoneType """
+        self._view = view
+
+    def get(self, username, default=None):
+        """ (_UserIds, str[, object]) -> object
+
+        Return the user ID of username, or default if it is not interned.
+        """
+        uid = self._view._lookup(username)
+        return default if uid < 0 else uid
+
+    def __getitem__(self, username):
+        """ (_UserIds, str) -> int """
+        uid = self._view._lookup(username)
+        if uid < 0:
+            raise KeyError(username)
+        return uid
+
+    def __contains__(self, username):
+        """ (_UserIds, str) -> bool """
+        return self._view._lookup(username) >= 0
+
+
+class ProfileView(Mapping):
+    """ A read-only profile dictionary whose fields are decoded on access. """
+
+    def __init__(self, view, uid):
+        """ (ProfileView, SnapshotView, int) -> NoneType """
+        self._view = view
+        self._uid = uid
+
+    def __getitem__(self, field):
+        """ (ProfileView, str) -> object
+
+        Return the value of field, decoding it from the snapshot.
+        """
+        view = self._view
+        if field == 'following':
+            names = view.usernames
+            offsets = view._fwd_offsets
+            return [names[i] for i in
+                    view._fwd_targets[offsets[self._uid]:
+                                      offsets[self._uid + 1]]]
+        k = 4 * self._uid + FIELD_INDEX[field]
+        return str(view._text_heap[view._field_offsets[k]:
+                                   view._field_offsets[k + 1]], 'utf-8')
+
+    def __iter__(self):
+        """ (ProfileView) -> iterator of str """
+        return iter(FIELDS + ('following',))
+
+    def __len__(self):
+        """ (ProfileView) -> int """
+        return len(FIELDS) + 1
+
+
+class SnapshotView(Mapping):
+    """ A read-only Twitterverse dictionary backed by a mapped snapshot. """
+
+    def __init__(self, buffer):
+        """ (SnapshotView, bytes-like) -> NoneType
+
+        Initialize a view over the snapshot contents in buffer.
+        """
+        if len(buffer) < HEADER.size + DIRECTORY.size:
+            raise SnapshotError('file is too short to be a snapshot')
+        magic, mark, n_names, n_known, n_edges = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise SnapshotError('not a Twitterverse snapshot')
+        if mark != BYTE_ORDER_MARK:
+            raise SnapshotError('snapshot was written with another byte order')
+        self._buffer = buffer
+        memory = memoryview(buffer)
+        directory = DIRECTORY.unpack_from(buffer, HEADER.size)
+        for i, section in enumerate(SECTIONS):
+            offset, length = directory[2 * i], directory[2 * i + 1]
+            data = memory[offset:offset + length]
+            if section in ARRAY_TYPES:
+                data = data.cast(ARRAY_TYPES[section])
+            setattr(self, '_' + section, data)
+        self._known = n_known
+        self._mask = len(self._id_table) - 1
+        self.usernames = _Usernames(self)
+        self._graph = None
+
+    def _lookup(self, username):
+        """ (SnapshotView, str) -> int
+
+        Return the user ID of username, or -1 if it is not interned.
+        """
+        data = username.encode('utf-8')
+        offsets = self._name_offsets
+        slot = zlib.crc32(data) & self._mask
+        uid = self._id_table[slot]
+        while uid != -1:
+            if self._name_heap[offsets[uid]:offsets[uid + 1]] == data:
+                return uid
+            slot = (slot + 1) & self._mask
+            uid = self._id_table[slot]
+        return -1
+
+    def __getitem__(self, username):
+        """ (SnapshotView, str) -> ProfileView
+
+        Return the profile of username.
+        """
+        uid = self._lookup(username)
+        if not 0 <= uid < self._known:
+            raise KeyError(username)
+        return ProfileView(self, uid)
+
+    def __contains__(self, username):
+        """ (SnapshotView, object) -> bool """
+        return (isinstance(username, str)
+                and 0 <= self._lookup(username) < self._known)
+
+    def __iter__(self):
+        """ (SnapshotView) -> iterator of str
+
+        Iterate over the usernames in their original dictionary order.
+        """
+        names = self.usernames
+        return (names[uid] for uid in range(self._known))
+
+    def __len__(self):
+        """ (SnapshotView) -> int """
+        return self._known
+
+    def graph(self):
+        """ (SnapshotView) -> TwitterGraph
+
+        Return a TwitterGraph over the mapped adjacency arrays, without
+        copying them.
+        """
+        if self._graph is None:
+            has_profile = (bytearray([1]) * self._known
+                           + bytearray(len(self.usernames) - self._known))
+            self._graph = TwitterGraph(
+                self.usernames, has_profile, self._fwd_offsets,
+                self._fwd_targets, self._rev_offsets, self._rev_sources,
+                _UserIds(self))
+        return self._graph
+
+    def close(self):
+        """ (SnapshotView) -> NoneType
+
+        Release the mapping.  The view must not be used afterwards.
+        """
+        for section in SECTIONS:
+            getattr(self, '_' + section).release()
+        self._graph = None
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def __enter__(self):
+        """ (SnapshotView) -> SnapshotView """
+        return self
+
+    def __exit__(self, *exc_info):
+        """ (SnapshotView, object, object, object) -> NoneType """
+        self.close()
+
+
+def load_snapshot(path):
+    """ (str) -> SnapshotView
+
+    Return a read-only Twitterverse dictionary mapped from the snapshot file
+    at path.
+
+    >>> import os, tempfile
+    >>> twitterverse = {\
+    'a':{'name':'Ann', 'location':'Oz', 'web':'', 'bio':'hi ', \
+    'following':['b', 'x']}, \
+    'b':{'name':'Bob', 'location':'', 'web':'', 'bio':'', 'following':['a']}}
+    >>> path = os.path.join(tempfile.mkdtemp(), 'twitterverse.snap')
+    >>> write_snapshot(twitterverse, path)
+    >>> view = load_snapshot(path)
+    >>> list(view), view['a'] == twitterverse['a'], 'x' in view
+    (['a', 'b'], True, False)
+    >>> view.graph().followers('a')
+    ['b']
+    >>> view.close()
+    """
+    with open(path, 'rb') as snapshot:
+        buffer = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+    return SnapshotView(buffer)
@@ -0,0 +1,123 @@
+"""
+Per-query tracing hooks for the query pipeline.
+
+A Tracer runs queries through run_query and, for the queries it samples,
+passes a Trace dictionary (see twitterverse_functions) to every registered
+hook.  A hook is any callable taking the trace; JsonLinesHook and StageTotals
+are provided.  Queries that are not traced, including every query while no
+hook is registered, run the untraced pipeline, so a Tracer can stay in place
+under load.
+
+Besides the fields documented for run_query, a Tracer adds:
+   - key "query", value represents the query (a Query dictionary)
+   - key "stages" also maps "parse" to the time process_query took, when the
+     query was given as a file, and "total" to the whole query's time
+"""
+
+import json
+import time
+
+from twitterverse_functions import process_query, run_query
+
+
+class Tracer:
+    """ Runs queries, passing a trace of each sampled query to hooks. """
+
+    def __init__(self, sample_every=1):
+        """ (Tracer[, int]) -> NoneType
+
+        Initialize a tracer with no hooks that traces one query in every
+        sample_every.
+        """
+        self.hooks = []
+        self.sample_every = sample_every
+        self.queries = 0
+
+    def add_hook(self, hook):
+        """ (Tracer, function) -> NoneType
+
+        Call hook with the trace of every sampled query.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """ (Tracer, function) -> NoneType
+
+        Stop calling hook.
+        """
+        self.hooks.remove(hook)
+
+    def run(self, twitterverse, query, graph=None, index=None):
+        """ (Tracer, Twitterverse dictionary, Query dictionary or file open
+        for reading[, TwitterGraph, Text index dictionary]) -> str
+
+        Return the output of query, which may be a query file, on
+        twitterverse, tracing it if it is sampled.
+
+        >>> a = {'katieH': {'web':'www.tomkat.com','name':'Katie Holmes',\
+        'following': [], 'location': '', 'bio': ''},\
+        'tomCruise':{'web': 'http://www.tomcruise.com', 'name': 'Tom Cruise',\
+        'following': ['katieH'], 'location': 'Los Angeles, CA', 'bio':''}}
+        >>> from io import StringIO
+        >>> query = StringIO('SEARCH\\nkatieH\\nfollowers\\nFILTER\\n'
+        ...                  'name-includes Kim\\nPRESENT\\nsort-by username\\n'
+        ...                  'format short\\n')
+        >>> tracer = Tracer()
+        >>> totals = StageTotals()
+        >>> tracer.add_hook(totals)
+        >>> tracer.run(a, query)
+        []
+        >>> totals.queries, totals.dropped
+        (1, {'name-includes': 1})
+        """
+        self.queries += 1
+        if not self.hooks or self.queries % self.sample_every:
+            if not isinstance(query, dict):
+                query = process_query(query)
+            return run_query(twitterverse, query, graph, index)
+
+        trace = {'stages': {}}
+        start = time.perf_counter()
+        if not isinstance(query, dict):
+            query = process_query(query)
+            trace['stages']['parse'] = time.perf_counter() - start
+        trace['query'] = query
+        output = run_query(twitterverse, query, graph, index, trace)
+        trace['stages']['total'] = time.perf_counter() - start
+        for hook in self.hooks:
+            hook(trace)
+        return output
+
+
+class JsonLinesHook:
+    """ A hook that writes each trace to a file as a line of JSON. """
+
+    def __init__(self, output):
+        """ (JsonLinesHook, file open for writing) -> NoneType """
+        self.output = output
+
+    def __call__(self, trace):
+        """ (JsonLinesHook, Trace dictionary) -> NoneType """
+        self.output.write(json.dumps(trace, sort_keys=True) + '\n')
+
+
+class StageTotals:
+    """ A hook that sums the traces of many queries. """
+
+    def __init__(self):
+        """ (StageTotals) -> NoneType """
+        self.queries = 0
+        self.seconds = {}
+        self.dropped = {}
+        self.sort_comparisons = 0
+        self.output_size = 0
+
+    def __call__(self, trace):
+        """ (StageTotals, Trace dictionary) -> NoneType """
+        self.queries += 1
+        for stage, seconds in trace['stages'].items():
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        for key, dropped in trace.get('filter_dropped', {}).items():
+            self.dropped[key] = self.dropped.get(key, 0) + dropped
+        self.sort_comparisons += trace.get('sort_comparisons', 0)
+        self.output_size += trace['output_size']